@@ -1,9 +1,14 @@
 """``espatools``: An open-source Python package for simple loading of Landsat imagery as NumPy arrays.
 """
 
+from .blocks import *
 from .meta import *
 from .raster import *
 from .read import *
+from .resampling import *
+from .shared import *
+from .store import *
+from .write import *
 
 
 __author__ = 'Bane Sullivan'
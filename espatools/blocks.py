@@ -0,0 +1,164 @@
+"""This module holds methods to process rasters block by block so that whole
+scenes never have to be loaded or allocated at once."""
+
+__all__ = [
+    'Window',
+    'iter_windows',
+    'iter_blocks',
+    'map_blocks',
+]
+
+import collections
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class Window(collections.namedtuple('Window', ['rows', 'cols', 'outer_rows', 'outer_cols'])):
+    """A block of a raster. ``rows`` and ``cols`` are the slices of the block
+    itself while ``outer_rows`` and ``outer_cols`` include the halo (clipped
+    to the raster extent)."""
+    __slots__ = ()
+
+    @property
+    def shape(self):
+        """The shape of the block without its halo"""
+        return (self.rows.stop - self.rows.start, self.cols.stop - self.cols.start)
+
+    @property
+    def outer_shape(self):
+        """The shape of the block with its halo"""
+        return (self.outer_rows.stop - self.outer_rows.start,
+                self.outer_cols.stop - self.outer_cols.start)
+
+    @property
+    def inner(self):
+        """The slices to crop a block with its halo back to the block"""
+        r0, c0 = self.outer_rows.start, self.outer_cols.start
+        return (slice(self.rows.start - r0, self.rows.stop - r0),
+                slice(self.cols.start - c0, self.cols.stop - c0))
+
+
+def iter_windows(nlines, nsamps, block_size=(512, None), halo=0):
+    """Iterate over the windows tiling a raster in row-major order.
+
+    Args:
+        nlines (int): the number of lines of the raster
+        nsamps (int): the number of samples of the raster
+        block_size (int or tuple): the ``(rows, cols)`` of each block. An int
+            gives square blocks and ``None`` spans the whole raster.
+        halo (int): the number of overlapping pixels added on each side
+    """
+    if not isinstance(block_size, (list, tuple)):
+        block_size = (block_size, block_size)
+    brows = block_size[0] or nlines
+    bcols = block_size[1] or nsamps
+    for r0 in range(0, nlines, brows):
+        r1 = min(r0 + brows, nlines)
+        for c0 in range(0, nsamps, bcols):
+            c1 = min(c0 + bcols, nsamps)
+            yield Window(
+                slice(r0, r1), slice(c0, c1),
+                slice(max(r0 - halo, 0), min(r1 + halo, nlines)),
+                slice(max(c0 - halo, 0), min(c1 + halo, nsamps)),
+            )
+
+
+def iter_blocks(fetch, names, nlines, nsamps, block_size=(512, None), halo=0):
+    """Iterate over aligned multi-band blocks.
+
+    Args:
+        fetch (callable): ``fetch(name, rows, cols)`` returns the data of a
+            band for the given slices
+        names (list(str)): the bands to fetch
+
+    Yields:
+        tuple(Window, list) : the window and the blocks (with halo) of each
+        band in the order of ``names``
+    """
+    for window in iter_windows(nlines, nsamps, block_size=block_size, halo=halo):
+        yield window, [fetch(nm, window.outer_rows, window.outer_cols) for nm in names]
+
+
+def _imap(func, items, threads):
+    """An ordered ``map`` on a thread pool that only keeps a few tasks in
+    flight so that the input is consumed lazily."""
+    if threads == 1:
+        for item in items:
+            yield func(item)
+        return
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        queue = collections.deque()
+        for item in items:
+            queue.append(pool.submit(func, item))
+            if len(queue) >= 2 * threads:
+                yield queue.popleft().result()
+        while queue:
+            yield queue.popleft().result()
+
+
+def map_blocks(func, fetch, names, nlines, nsamps, out=None,
+               block_size=(512, None), halo=0, threads=None, pass_window=False):
+    """Apply a function block by block and gather the results.
+
+    Args:
+        func (callable): called as ``func(*blocks)`` with the block of each
+            band in ``names``. It returns an array whose first two axes match
+            either the block or the block with its halo (which is cropped).
+        fetch (callable): ``fetch(name, rows, cols)`` returns the data of a
+            band for the given slices
+        names (list(str)): the bands to pass to ``func``
+        out: where to store the results. ``None`` allocates an array, an
+            array (e.g. a ``np.memmap``) is filled in place and an object with
+            a ``write`` method (e.g. a ``GeoTiffWriter``) receives the results
+            as full width strips from top to bottom.
+        threads (int): the number of threads running blocks (``1`` runs them
+            serially)
+        pass_window (bool): also pass the ``Window`` to ``func`` as the
+            ``window`` keyword argument
+
+    Return:
+        the output
+    """
+    if threads is None:
+        threads = os.cpu_count()
+
+    def run(window):
+        blocks = [fetch(nm, window.outer_rows, window.outer_cols) for nm in names]
+        if pass_window:
+            result = func(*blocks, window=window)
+        else:
+            result = func(*blocks)
+        result = np.asanyarray(result)
+        if result.shape[:2] == window.outer_shape and window.outer_shape != window.shape:
+            result = result[window.inner]
+        elif result.shape[:2] != window.shape:
+            raise RuntimeError('Block result shape %s does not match the window.' % (result.shape,))
+        return window, result
+
+    windows = iter_windows(nlines, nsamps, block_size=block_size, halo=halo)
+    strip = []
+    for window, result in _imap(run, windows, threads):
+        if out is None:
+            shape = (nlines, nsamps) + result.shape[2:]
+            if isinstance(result, np.ma.MaskedArray):
+                out = np.ma.masked_all(shape, dtype=result.dtype)
+            else:
+                out = np.empty(shape, dtype=result.dtype)
+        if hasattr(out, 'write'):
+            # Gather a full width strip before streaming it
+            strip.append(result)
+            if window.cols.stop == nsamps:
+                if len(strip) == 1:
+                    out.write(strip[0])
+                elif any(isinstance(r, np.ma.MaskedArray) for r in strip):
+                    out.write(np.ma.concatenate(strip, axis=1))
+                else:
+                    out.write(np.concatenate(strip, axis=1))
+                strip = []
+        elif isinstance(out, np.ma.MaskedArray) or not isinstance(result, np.ma.MaskedArray):
+            out[window.rows, window.cols] = result
+        else:
+            out[window.rows, window.cols] = result.filled()
+    return out
@@ -4,10 +4,18 @@ __all__ = [
     'RasterSet',
 ]
 
+import collections
+import weakref
+
 import properties
 import numpy as np
 
 from .meta import *
+from .resampling import grid_scale, reference_band, resample
+
+
+# The number of resampled bands cached by each RasterSet
+_MAX_RESAMPLED = 4
 
 
 class Band(properties.HasProperties):
@@ -123,6 +131,7 @@ class RasterSet(properties.HasProperties):
     nlines = properties.Integer('The number of lines')
     nsamps = properties.Integer('The number of samples')
     pixel_size = properties.Instance('The pixel size', PixelSize)
+    yflip = properties.Boolean('Whether the band data is flipped on the y axis (south up)', default=False)
 
     RGB_SCHEMES = dict(
         true=ColorSchemes.LOOKUP_TRUE_COLOR,
@@ -133,10 +142,14 @@ class RasterSet(properties.HasProperties):
     )
 
 
-    def get_rgb(self, scheme='infrared', names=None):
+    def get_rgb(self, scheme='infrared', names=None, pan=None, method='bilinear'):
         """Get an RGB color scheme based on predefined presets or specify your
         own band names to use. A given set of names always overrides a scheme.
 
+        Bands on a different grid than the raster are resampled with
+        ``method``. Give the name of a panchromatic band as ``pan`` to
+        pan-sharpen the result (Brovey transform) on the grid of that band.
+
         Note:
             Available schemes are defined in ``RGB_SCHEMES`` and include:
 
@@ -155,14 +168,18 @@ class RasterSet(properties.HasProperties):
             names = lookup[self.global_metadata.satellite]
 
         # Now check that all bands are available:
-        for nm in names:
+        for nm in list(names) + ([pan] if pan is not None else []):
             if nm not in self.bands.keys():
                 raise RuntimeError('Band (%s) unavailable.' % nm)
 
-        # Get the RGB bands
-        r = self.bands[names[0]].data
-        g = self.bands[names[1]].data
-        b = self.bands[names[2]].data
+        # Get the RGB bands on the grid of the raster (or the pan band)
+        r, g, b = [self.resample(nm, target=pan, method=method) for nm in names]
+        if pan is not None:
+            # Brovey transform: scale the bands by the pan band intensity
+            ratio = self.bands[pan].data / ((r + g + b) / 3.0)
+            if not isinstance(ratio, np.ma.MaskedArray):
+                ratio[~np.isfinite(ratio)] = np.nan
+            r, g, b = r * ratio, g * ratio, b * ratio
         # Note that the bands should already be masked from read.
         # If casted then there are np.nans present
         r = ((r - np.nanmin(r)) * (1/(np.nanmax(r) - np.nanmin(r)) * 255)).astype('uint8')
@@ -175,17 +192,192 @@ class RasterSet(properties.HasProperties):
         return self.get_rgb(*args, **kwargs)
 
 
+    def to_geotiff(self, filename, names=None, scheme=None, **kwargs):
+        """Write bands of this raster to a tiled, compressed GeoTIFF that is
+        georeferenced from this raster's projection information.
+
+        Args:
+            filename (str): the output file name
+            names (list(str)): the bands to write (all bands by default). Each
+                band is a sample of the output pixels.
+            scheme (str): write the RGB composite of this scheme (see
+                ``get_rgb``) rather than the bands
+            **kwargs: passed to :class:`espatools.GeoTiffWriter`
+        """
+        from .write import write_geotiff
+        # GeoTIFFs are written north up
+        unflip = (lambda arr: np.flip(arr, 0)) if self.yflip else (lambda arr: arr)
+        if scheme is not None:
+            # Masked pixels of the composite are written black
+            rgb = np.ma.filled(self.get_rgb(scheme=scheme), 0)
+            return write_geotiff(filename, unflip(rgb), raster=self, **kwargs)
+        if names is None:
+            names = list(self.bands.keys())
+        for nm in names:
+            if nm not in self.bands.keys() or self.bands[nm].data is None:
+                raise RuntimeError('Band (%s) unavailable.' % nm)
+        arrays = [unflip(self.resample(nm)) for nm in names]
+        dtype = np.result_type(*arrays)
+        if 'nodata' not in kwargs:
+            # Casted bands use NaNs, masked bands use the fill value
+            if dtype.kind == 'f':
+                kwargs['nodata'] = np.nan
+            elif any(isinstance(a, np.ma.MaskedArray) for a in arrays):
+                kwargs['nodata'] = self.bands[names[0]].fill_value
+        step = kwargs.get('tile_size', 256)
+        # Stream strips so the bands are never stacked in full
+        strips = (np.ma.dstack([a[i:i + step] for a in arrays])
+                  for i in range(0, self.nlines, step))
+        return write_geotiff(filename, strips, raster=self, nlines=self.nlines,
+                             nsamps=self.nsamps, nbands=len(names), dtype=dtype,
+                             **kwargs)
+
+
+    def save(self, filename, names=None, compress=None, **kwargs):
+        """Save this raster and its band data to a compact binary file that
+        can be memory mapped with :func:`espatools.load_raster`.
+
+        Args:
+            filename (str): the output file name
+            names (list(str)): the bands to save (all loaded bands by default)
+            compress: ``None``, ``'deflate'`` or a dictionary of band names to
+                either
+        """
+        from .store import save_raster
+        return save_raster(self, filename, names=names, compress=compress, **kwargs)
+
+
+    def share(self, names=None):
+        """Publish bands of this raster to shared memory for worker processes.
+
+        Args:
+            names (list(str)): the bands to share (all loaded bands by default)
+
+        Return:
+            SharedRasterSet : the owner of the shared memory. Pass its
+            ``handle`` to workers and call its ``close`` method when done.
+        """
+        from .shared import SharedRasterSet
+        return SharedRasterSet(self, names=names)
+
+
+    def resample(self, name, target=None, method='bilinear'):
+        """Get the data of a band on another grid covering the same extent.
+        The last few results are cached until the band data changes (see
+        ``clear_resampled``).
+
+        Args:
+            name (str): the band to resample
+            target (str): the band whose grid to use (the grid of the raster
+                by default)
+            method (str): ``'nearest'``, ``'bilinear'`` or ``'average'``
+
+        Return:
+            np.ndarray : the band data on the target grid (the band data
+            itself if it is already on that grid)
+        """
+        band = self.bands[name]
+        if band.data is None:
+            raise RuntimeError('Band (%s) unavailable.' % name)
+        ref = reference_band(self.bands.values()) if target is None else self.bands[target]
+        scale = grid_scale(band, ref)
+        if scale is None:
+            return band.data
+        key = (name, ref.name, method)
+        data = self._get_resampled(key)
+        if data is not None:
+            return data
+        data = resample(band.data, (ref.nlines, ref.nsamps), scale, method=method)
+        cache = self.__dict__.setdefault('_resampled', collections.OrderedDict())
+        # Only hold a weak reference to the source so it can be freed
+        cache[key] = (weakref.ref(band.data), data)
+        while len(cache) > _MAX_RESAMPLED:
+            cache.popitem(last=False)
+        return data
+
+
+    def _get_resampled(self, key):
+        """Get a cached resampled band if its source data has not changed"""
+        cache = self.__dict__.get('_resampled')
+        if not cache or key not in cache:
+            return None
+        source, data = cache[key]
+        if source() is not self.bands[key[0]].data:
+            del cache[key]
+            return None
+        cache.move_to_end(key)
+        return data
+
+
+    def clear_resampled(self):
+        """Drop the cached resampled bands"""
+        self.__dict__.pop('_resampled', None)
+
+
+    def _block_source(self, names, method):
+        """Get the band names, shape and fetch method for block processing"""
+        if names is None:
+            names = list(self.bands.keys())
+        for nm in names:
+            if nm not in self.bands.keys() or self.bands[nm].data is None:
+                raise RuntimeError('Band (%s) unavailable.' % nm)
+        ref = reference_band(self.bands.values())
+        shape = (ref.nlines, ref.nsamps)
+        scales = {nm: grid_scale(self.bands[nm], ref) for nm in names}
+
+        def fetch(nm, rows, cols):
+            band = self.bands[nm]
+            if scales[nm] is None:
+                return band.data[rows, cols]
+            cached = self._get_resampled((nm, ref.name, method))
+            if cached is not None:
+                return cached[rows, cols]
+            # Resample only the window
+            return resample(band.data, shape, scales[nm], method=method, rows=rows, cols=cols)
+
+        return names, shape, fetch
+
+
+    def iter_blocks(self, names=None, block_size=(512, None), halo=0,
+                    resampling='bilinear'):
+        """Iterate over aligned blocks of the loaded bands. The blocks are
+        views of the band data (masked arrays keep their masks). Bands on a
+        different grid than the raster are resampled block by block.
+
+        Args:
+            names (list(str)): the bands to include (all bands by default)
+            block_size (int or tuple): the ``(rows, cols)`` of each block.
+                ``None`` spans the whole raster (full width strips by default).
+            halo (int): the number of overlapping pixels added on each side
+            resampling (str): the method to resample bands on other grids
+
+        Yields:
+            tuple(Window, list) : the window and the blocks of each band
+        """
+        from .blocks import iter_blocks
+        names, shape, fetch = self._block_source(names, resampling)
+        return iter_blocks(fetch, names, shape[0], shape[1],
+                           block_size=block_size, halo=halo)
+
+
+    def map_blocks(self, func, names=None, out=None, resampling='bilinear', **kwargs):
+        """Apply ``func(*blocks)`` block by block over the loaded bands, on a
+        thread pool, and gather the results in ``out``.
+        See :func:`espatools.map_blocks` for the options.
+        """
+        from .blocks import map_blocks
+        names, shape, fetch = self._block_source(names, resampling)
+        return map_blocks(func, fetch, names, shape[0], shape[1], out=out, **kwargs)
+
+
     def validate(self):
-        b = self.bands.get(list(self.bands.keys())[0])
-        ny, nx = b.nlines, b.nsamps
-        dx, dy = b.pixel_size.x, b.pixel_size.y
+        # Bands may be on different grids covering the same extent: the most
+        # common pixel size defines the grid of the raster
+        b = reference_band(self.bands.values())
         for name, band in self.bands.items():
-            if band.nlines != ny or band.nsamps != nx:
-                raise RuntimeError('Band size mismatch.')
-            if band.pixel_size.x != dx or band.pixel_size.y != dy:
-                raise RuntimeError('Pixel size mismatch.')
-        self.nlines = ny
-        self.nsamps = nx
+            grid_scale(band, b)
+        self.nlines = b.nlines
+        self.nsamps = b.nsamps
         self.pixel_size = b.pixel_size
         return properties.HasProperties.validate(self)
 
@@ -208,16 +400,15 @@ class RasterSet(properties.HasProperties):
 
         # Add data arrays
         clean = lambda arr: np.flip(arr, axis=0)
-        for name, band in self.bands.items():
-            output[name] = clean(band.data).ravel()
+        data = None
+        for name in self.bands.keys():
+            data = self.resample(name)
+            output[name] = clean(data).ravel()
         for scheme in list(self.RGB_SCHEMES.keys()):
             output[scheme] = clean(self.get_rgb(scheme=scheme)).reshape((-1,3))
-        # Add an array for the mask
-        try:
-            mask = clean(~band.data.mask).ravel()
-            output["valid_mask"] = mask
-        except NameError:
-            pass
+        # Add an array for the mask (of the last band, on the raster grid)
+        if data is not None:
+            output["valid_mask"] = clean(~np.ma.getmaskarray(data)).ravel()
 
         # Return the dataset
         return output
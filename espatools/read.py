@@ -10,9 +10,67 @@ import numpy as np
 from PIL import Image
 import os
 import collections
+import threading
+import zlib
 import properties
 
+from .blocks import iter_blocks, map_blocks
 from .raster import RasterSet, Band
+from .resampling import grid_scale, reference_band, resample
+
+
+# The minimum number of whole decoded bands kept for block reads of tifs that
+# cannot be read strip by strip
+_MAX_DECODED = 2
+
+# The data types ``read_tif`` (Pillow) decodes each image mode to
+_MODE_DTYPES = {
+    '1': np.bool_,
+    'L': np.uint8,
+    'P': np.uint8,
+    'I;16': '<u2',
+    'I;16B': '>u2',
+    'I': np.int32,
+    'F': np.float32,
+}
+
+
+class _TifStrips(object):
+    """Read windows of a strip organised tif by only decoding the strips
+    covering the requested rows. Supports uncompressed and deflate strips with
+    or without horizontal differencing."""
+
+    def __init__(self, filename, layout):
+        self.filename = filename
+        self.layout = layout
+        self.shape = layout['shape']
+        self.dtype = layout['dtype']
+
+    def _strip(self, f, i):
+        lay = self.layout
+        f.seek(lay['offsets'][i])
+        buf = f.read(lay['counts'][i])
+        if lay['compression'] != 1:
+            buf = zlib.decompress(buf)
+        nrows = min(lay['rows_per_strip'], self.shape[0] - i * lay['rows_per_strip'])
+        strip = np.frombuffer(buf, dtype=self.dtype, count=nrows * self.shape[1])
+        strip = strip.reshape(nrows, self.shape[1])
+        if lay['predictor'] == 2:
+            strip = np.cumsum(strip, axis=1, dtype=self.dtype)
+        return strip
+
+    def __getitem__(self, key):
+        rows, cols = key
+        start, stop, _ = rows.indices(self.shape[0])
+        stop = max(start, stop)
+        rps = self.layout['rows_per_strip']
+        first, last = start // rps, -(-stop // rps)
+        with open(self.filename, 'rb') as f:
+            strips = [self._strip(f, i) for i in range(first, last)]
+        if not strips:
+            return np.empty((0, self.shape[1]), dtype=self.dtype)[:, cols]
+        rows = slice(start - first * rps, stop - first * rps)
+        return np.concatenate(strips, axis=0)[rows, cols]
 
 
 def set_properties(has_props_cls, input_dict, include_immutable=True):
@@ -52,12 +110,35 @@ def set_properties(has_props_cls, input_dict, include_immutable=True):
     return props #, others_dict
 
 class RasterSetReader(object):
-    """Read a series of raster files via their XML metadata file in ESPA schema"""
+    """Read a series of raster files via their XML metadata file in ESPA schema.
+
+    The reader is incremental: the parsed XML metadata and the decoded band
+    data are cached between calls to ``read`` so that requesting more bands
+    only loads the missing ones and toggling ``cast`` converts the cached data
+    rather than reading the files again. Use ``clear_cache`` to free memory.
+
+    Note:
+        The raw data of every band in ``bdict`` stays cached (read-only) so it
+        can be converted when ``cast`` changes, on top of the copy held by the
+        returned band. Bands dropped through ``allowed`` are evicted from the
+        cache.
+    """
 
     def __init__(self, **kwargs):
         self.filename = kwargs.get('filename', None)
         self.yflip = kwargs.get('yflip', False)
         self.bdict = dict()
+        # Cached state for incremental reads
+        self._meta = None
+        self._meta_key = None
+        self._bands = collections.OrderedDict()  # metadata templates (no data)
+        self._raw = dict()
+        self._state = dict()
+        self._mmaps = dict()
+        self._dtypes = dict()
+        self._decoded = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._band_locks = dict()
 
     @staticmethod
     def read_tif(tifFile):
@@ -66,6 +147,61 @@ class RasterSetReader(object):
         img = np.array(img)
         return img
 
+    @staticmethod
+    def tif_layout(tifFile):
+        """Get the strip layout of a single band tif file. Returns ``None``
+        for tiled or multi-sample files and for unsupported data types."""
+        with open(tifFile, 'rb') as f:
+            endian = '<' if f.read(2) == b'II' else '>'
+        with Image.open(tifFile) as img:
+            tags = img.tag_v2
+            if tags.get(277, 1) != 1 or 273 not in tags or 322 in tags:
+                return None
+            offsets, counts = tags[273], tags[279]
+            bits = tags.get(258, 1)
+            fmt = tags.get(339, 1)
+            nx, ny = img.size
+            layout = dict(
+                compression=tags.get(259, 1),
+                predictor=tags.get(317, 1),
+                rows_per_strip=min(tags.get(278, ny), ny),
+                decoded=_MODE_DTYPES.get(img.mode),
+            )
+        if isinstance(offsets, int):
+            offsets, counts = (offsets,), (counts,)
+        if isinstance(bits, tuple):
+            bits = bits[0]
+        if isinstance(fmt, tuple):
+            fmt = fmt[0]
+        kind = {1: 'u', 2: 'i', 3: 'f'}.get(fmt)
+        if kind is None or bits % 8:
+            return None
+        layout.update(
+            dtype=np.dtype('%s%s%d' % (endian, kind, bits // 8)),
+            shape=(ny, nx),
+            offsets=tuple(offsets),
+            counts=tuple(counts),
+        )
+        return layout
+
+    @staticmethod
+    def memmap_tif(tifFile, layout=None):
+        """Memory map a single band, uncompressed tif file with contiguous
+        strips as a read-only 2D NumPy array. Returns ``None`` for any other
+        layout."""
+        if layout is None:
+            layout = RasterSetReader.tif_layout(tifFile)
+        if layout is None or layout['compression'] != 1:
+            return None
+        offsets, counts = layout['offsets'], layout['counts']
+        for i in range(1, len(offsets)):
+            if offsets[i] != offsets[i - 1] + counts[i - 1]:
+                return None
+        dtype, shape = layout['dtype'], layout['shape']
+        if sum(counts) != shape[0] * shape[1] * dtype.itemsize:
+            return None
+        return np.memmap(tifFile, dtype=dtype, mode='r', offset=offsets[0], shape=shape)
+
     @staticmethod
     def clean_dict(d):
         d = {key.replace('@', '').replace('#', ''): item for key, item in d.items()}
@@ -79,6 +215,128 @@ class RasterSetReader(object):
         return d
 
 
+    def read_raw(self, band):
+        """Get the raw decoded data for a band, reading its file only if it is
+        not already cached.
+
+        Args:
+            band (Band): the band metadata object
+
+        Return:
+            np.ndarray : the raw 2D array as stored on disk
+        """
+        raw = self._raw.get(band.name)
+        if raw is None:
+            fname = band.file_name
+            raw = self.read_tif('%s/%s' % (os.path.dirname(self.filename), fname))
+            # Conversions copy the cached data: never let it be changed
+            raw.flags.writeable = False
+            self._raw[band.name] = raw
+        return raw
+
+
+    def open_band(self, band, keep=_MAX_DECODED):
+        """Get the raw data for a band without decoding the whole file where
+        possible: the cached raw data if the band was read, otherwise a memory
+        map of the tif file or a reader decoding only the strips of a window.
+        Other files (e.g. LZW compressed or tiled) are decoded whole and only
+        the last few are kept. This is safe to call from several threads.
+
+        Args:
+            band (Band): the band metadata object
+            keep (int): the number of whole decoded bands to keep. Use at
+                least the number of bands read together.
+
+        Return:
+            the raw 2D data as stored on disk (an array or an object with a
+            ``shape`` that can be sliced like one)
+        """
+        raw = self._raw.get(band.name)
+        if raw is not None:
+            return raw
+        with self._lock:
+            lock = self._band_locks.setdefault(band.name, threading.Lock())
+        with lock:
+            raw = self._mmaps.get(band.name)
+            if raw is not None:
+                return raw
+            with self._lock:
+                raw = self._decoded.get(band.name)
+                if raw is not None:
+                    self._decoded.move_to_end(band.name)
+                    return raw
+            fname = '%s/%s' % (os.path.dirname(self.filename), band.file_name)
+            layout = self.tif_layout(fname)
+            raw = self.memmap_tif(fname, layout=layout)
+            if raw is None and layout is not None and (
+                    layout['compression'] in (1, 8, 32946)
+                    and layout['predictor'] in (1, 2)):
+                raw = _TifStrips(fname, layout)
+            if raw is not None:
+                self._mmaps[band.name] = raw
+                if layout['decoded'] is not None:
+                    self._dtypes[band.name] = np.dtype(layout['decoded'])
+                return raw
+            raw = self.read_tif(fname)
+            with self._lock:
+                self._decoded[band.name] = raw
+                while len(self._decoded) > max(keep, 1):
+                    self._decoded.popitem(last=False)
+            return raw
+
+
+    def read_block(self, band, rows, cols, cast=False, keep=_MAX_DECODED):
+        """Read and convert a window of a band. The slices are in the
+        coordinates of the data returned by ``read`` (i.e. flipped if
+        ``yflip`` is set).
+
+        Args:
+            band (Band): the band metadata object
+            rows (slice): the rows of the window
+            cols (slice): the columns of the window
+            cast (bool): see ``convert``
+            keep (int): see ``open_band``
+
+        Return:
+            np.ndarray : the converted window
+        """
+        raw = self.open_band(band, keep=keep)
+        if self.yflip:
+            ny = raw.shape[0]
+            rows = slice(ny - rows.stop, ny - rows.start)
+        # Blocks have the data type of the bands returned by ``read``
+        block = np.asarray(raw[rows, cols], dtype=self._dtypes.get(band.name))
+        return self.convert(band, block, cast=cast)
+
+
+    def convert(self, band, raw, cast=False):
+        """Convert raw band data to its masked or casted representation.
+
+        Args:
+            band (Band): the band metadata object
+            raw (np.ndarray): the raw data for that band
+            cast (bool): if True, return floats with NaNs for invalid values.
+                Otherwise return a masked array of the original type.
+
+        Return:
+            np.ndarray : the converted data (flipped on the y axis if set)
+        """
+        invalid = raw == band.fill_value
+        if band.valid_range is not None:
+            invalid |= raw < band.valid_range.min
+            invalid |= raw > band.valid_range.max
+        if cast:
+            # cast as floats and fill bad values with nans
+            data = raw.astype(np.float32)
+            data[invalid] = np.nan
+        else:
+            data = np.ma.masked_array(raw, mask=invalid, copy=True)
+        # Flip y axis if requested
+        if self.yflip:
+            data = np.flip(data, 0)
+        return data
+
+
     def generate_band(self, band, meta_only=False, cast=False):
         """Genreate a Band object given band metadata
 
@@ -88,12 +346,6 @@ class RasterSetReader(object):
         Return:
             Band : the loaded Band onject"""
 
-        # Read the band data and add it to dictionary
-        if not meta_only:
-            fname = band.get('file_name')
-            data = self.read_tif('%s/%s' % (os.path.dirname(self.filename), fname))
-            # band['data'] = data # TODO: data is not a properties object so do not set yet
-
         def fix_bitmap(d):
             p = d.get('bitmap_description')
             if p:
@@ -110,34 +362,24 @@ class RasterSetReader(object):
 
         band = set_properties(Band, fix_bitmap(self.clean_dict(band)))
         if not meta_only:
-            if cast:
-                # cast as floats and fill bad values with nans
-                data = data.astype(np.float32)
-                data[data==band.fill_value] = -9999
-                if band.valid_range is not None:
-                    data[data<band.valid_range.min] = -9999
-                    data[data>band.valid_range.max] = -9999
-                data[data==-9999] = np.nan
-            else:
-                data = np.ma.masked_where(data==band.fill_value, data)
-                if band.valid_range is not None:
-                    data = np.ma.masked_where(data<band.valid_range.min, data)
-                    data = np.ma.masked_where(data>band.valid_range.max, data)
-            # Flip y axis if requested
-            if self.yflip:
-                data = np.flip(data, 0)
-            band.data = data
-
-        if not meta_only:
+            # Read the band data (or use the cached copy) and convert it
+            band.data = self.convert(band, self.read_raw(band), cast=cast)
             band.validate()
 
         return band
 
 
-    def read(self, meta_only=False, allowed=None, cast=False):
-        """Read the ESPA XML metadata file"""
-        if allowed is not None and not isinstance(allowed, (list, tuple)):
-            raise RuntimeError('`allowed` must be a list of str names.')
+    def read_meta(self):
+        """Parse the ESPA XML metadata file and generate the metadata for all
+        bands. The result is cached until the file name or the file's
+        modification time changes.
+
+        Return:
+            dict : the cleaned global metadata
+        """
+        key = (self.filename, os.path.getmtime(self.filename))
+        if self._meta_key == key:
+            return self._meta
 
         meta = xmltodict.parse(
                 open(self.filename, 'r').read()
@@ -149,31 +391,138 @@ class RasterSetReader(object):
 
         if not isinstance(bands, (list)):
             bands = [bands]
-        meta = self.clean_dict(meta)
+
+        # A new file invalidates everything cached for the previous one
+        self.clear_cache()
+        self.bdict = dict()
+        self._bands = collections.OrderedDict()
+        for b in bands:
+            info = self.generate_band(b, meta_only=True)
+            self._bands[info.name] = info
+
+        self._meta = self.clean_dict(meta)
+        self._meta_key = key
+        return self._meta
+
+
+    def clear_cache(self):
+        """Drop the cached raw band data, memory maps and decoded files. The
+        parsed metadata and any bands already returned by ``read`` are kept;
+        the next conversion of a band reads its file again.
+        """
+        self._raw = dict()
+        self._mmaps = dict()
+        self._dtypes = dict()
+        self._decoded = collections.OrderedDict()
+
+
+    def _block_source(self, names, cast, method):
+        """Get the band names, shape and fetch method for block processing"""
+        self.read_meta()
+        if names is None:
+            names = list(self._bands.keys())
+        for nm in names:
+            if nm not in self._bands:
+                raise RuntimeError('Band (%s) unavailable.' % nm)
+        # Blocks are on the grid of the whole scene
+        ref = reference_band(self._bands.values())
+        shape = (ref.nlines, ref.nsamps)
+        scales = {nm: grid_scale(self._bands[nm], ref) for nm in names}
+        # Every window reads every band: keep all of them if decoded whole
+        keep = max(_MAX_DECODED, len(names))
+
+        def fetch(nm, rows, cols):
+            band = self._bands[nm]
+            if scales[nm] is None:
+                return self.read_block(band, rows, cols, cast=cast, keep=keep)
+            # Only read the part of the band needed for the window
+            source = lambda r, c: self.read_block(band, r, c, cast=cast, keep=keep)
+            return resample(source, shape, scales[nm], method=method, rows=rows,
+                            cols=cols, source_shape=(band.nlines, band.nsamps))
+
+        return names, shape, fetch
+
+
+    def iter_blocks(self, names=None, cast=False, block_size=(512, None), halo=0,
+                    resampling='bilinear'):
+        """Iterate over aligned blocks of bands read from disk, without
+        loading whole bands. Uncompressed tifs are memory mapped and deflate
+        compressed tifs are read strip by strip. Other files (e.g. LZW
+        compressed or tiled) are decoded whole, once per band. Blocks have
+        the data type of the bands returned by ``read``. Bands on a different
+        grid than the scene are resampled block by block.
+
+        Args:
+            names (list(str)): the bands to include (all bands by default)
+            cast (bool): see ``read``
+            block_size (int or tuple): the ``(rows, cols)`` of each block.
+                ``None`` spans the whole raster (full width strips by default).
+            halo (int): the number of overlapping pixels added on each side
+            resampling (str): the method to resample bands on other grids
+
+        Yields:
+            tuple(Window, list) : the window and the blocks of each band
+        """
+        names, shape, fetch = self._block_source(names, cast, resampling)
+        return iter_blocks(fetch, names, shape[0], shape[1],
+                           block_size=block_size, halo=halo)
+
+
+    def map_blocks(self, func, names=None, out=None, cast=False,
+                   resampling='bilinear', **kwargs):
+        """Apply ``func(*blocks)`` block by block over bands read from disk,
+        on a thread pool, and gather the results in ``out``. Use a memory map
+        or a ``GeoTiffWriter`` as ``out`` to process scenes larger than memory.
+        The blocks are read as in ``iter_blocks``: they have the data type of
+        the bands returned by ``read``, so ``func`` behaves as it does with
+        :meth:`RasterSet.map_blocks`. See :func:`espatools.map_blocks` for the
+        options.
+        """
+        names, shape, fetch = self._block_source(names, cast, resampling)
+        return map_blocks(func, fetch, names, shape[0], shape[1], out=out, **kwargs)
+
+
+    def read(self, meta_only=False, allowed=None, cast=False):
+        """Read the ESPA XML metadata file and the requested bands.
+
+        Only bands that have not been loaded yet are read from disk. Bands
+        already loaded with a different ``cast`` option are converted from the
+        cached raw data.
+        """
+        if allowed is not None and not isinstance(allowed, (list, tuple)):
+            raise RuntimeError('`allowed` must be a list of str names.')
+
+        meta = self.read_meta()
 
         # Get spatial refernce
         ras = set_properties(RasterSet, meta)
 
         if allowed is not None:
-            # Remove non-allowed arrays from bdict
+            # Remove non-allowed arrays from bdict and the cache
             for k in list(self.bdict.keys()):
                 if k not in allowed:
                     del(self.bdict[k])
+                    self._raw.pop(k, None)
+                    self._state.pop(k, None)
 
-        for i in range(len(bands)):
-            info = self.generate_band(bands[i], meta_only=True, cast=cast)
-            if allowed is not None and info.name not in allowed:
+        state = (bool(cast), bool(self.yflip))
+        for name, template in self._bands.items():
+            if allowed is not None and name not in allowed:
+                continue
+            band = self.bdict.get(name)
+            if meta_only:
+                if band is None:
+                    self.bdict[name] = properties.copy(template)
                 continue
-            if info.name not in self.bdict.keys() or self.bdict[info.name].data is None:
-                b = self.generate_band(bands[i], meta_only=meta_only, cast=cast)
-                self.bdict[b.name] = b
-            elif cast and self.bdict[info.name].data.dtype != np.float32:
-                b = self.generate_band(bands[i], meta_only=meta_only, cast=cast)
-                self.bdict[b.name] = b
-            elif not cast and self.bdict[info.name].data.dtype == np.float32:
-                b = self.generate_band(bands[i], meta_only=meta_only, cast=cast)
-                self.bdict[b.name] = b
+            if band is None or band.data is None or self._state.get(name) != state:
+                # A fresh band so rasters returned earlier are never changed
+                band = properties.copy(template)
+                band.data = self.convert(band, self.read_raw(band), cast=cast)
+                band.validate()
+                self.bdict[name] = band
+                self._state[name] = state
         ras.bands = self.bdict
+        ras.yflip = bool(self.yflip)
 
         if not meta_only:
             ras.validate()
@@ -0,0 +1,170 @@
+"""This module holds methods to resample bands between grids of different
+resolutions covering the same extent (e.g. 15 m panchromatic, 30 m
+reflectance and 100 m thermal bands)."""
+
+__all__ = [
+    'resample',
+]
+
+import collections
+import functools
+
+import numpy as np
+
+
+# The number of target rows resampled at once
+_BLOCK_ROWS = 128
+
+
+def reference_band(bands):
+    """Get the band defining the grid of a set of bands: the first band with
+    the most common pixel size."""
+    bands = list(bands)
+    sizes = collections.Counter((b.pixel_size.x, b.pixel_size.y) for b in bands)
+    dx, dy = sizes.most_common(1)[0][0]
+    for b in bands:
+        if b.pixel_size.x == dx and b.pixel_size.y == dy:
+            return b
+
+
+def grid_scale(band, ref):
+    """Get the ``(y, x)`` size of the pixels of ``ref`` in pixels of
+    ``band``, or ``None`` if both are on the same grid."""
+    if band.pixel_size.x == ref.pixel_size.x and band.pixel_size.y == ref.pixel_size.y:
+        if band.nlines != ref.nlines or band.nsamps != ref.nsamps:
+            raise RuntimeError('Band size mismatch.')
+        return None
+    # Bands on different grids must still cover the same extent
+    for n, d, rn, rd in ((band.nlines, band.pixel_size.y, ref.nlines, ref.pixel_size.y),
+                         (band.nsamps, band.pixel_size.x, ref.nsamps, ref.pixel_size.x)):
+        if abs(n * d - rn * rd) > max(d, rd):
+            raise RuntimeError('Band extent mismatch.')
+    return (ref.pixel_size.y / band.pixel_size.y, ref.pixel_size.x / band.pixel_size.x)
+
+
+@functools.lru_cache(maxsize=64)
+def _weights(n_out, n_in, scale, method):
+    """Build the weights resampling one axis as two ``(n_out, k)`` arrays:
+    the input indices and the weights of each output pixel. Each output pixel
+    covers ``scale`` input pixels."""
+    i = np.arange(n_out, dtype=np.float64)
+    if method == 'nearest':
+        index = np.floor((i + 0.5) * scale)[:, None]
+        vals = np.ones_like(index)
+    elif method == 'bilinear':
+        x = (i + 0.5) * scale - 0.5
+        j = np.floor(x)
+        f = x - j
+        index = np.stack([j, j + 1], axis=1)
+        vals = np.stack([1.0 - f, f], axis=1)
+    elif method == 'average':
+        # The overlap of the output pixel [a, b) with each input pixel
+        a, b = i * scale, (i + 1) * scale
+        span = int(np.ceil(scale)) + 1
+        index = np.floor(a)[:, None] + np.arange(span)[None, :]
+        vals = np.minimum(b[:, None], index + 1) - np.maximum(a[:, None], index)
+        vals[(vals < 0) | (index >= n_in)] = 0.0
+        vals /= np.maximum(vals.sum(axis=1, keepdims=True), 1e-12)
+    else:
+        raise RuntimeError('Resampling method (%s) unavailable.' % method)
+    index = np.clip(index, 0, n_in - 1).astype(np.intp)
+    return index, vals.astype(np.float32)
+
+
+def _window(weights, sl):
+    """Crop the weights to a window of outputs and the inputs it needs"""
+    index, vals = weights[0][sl], weights[1][sl]
+    if index.size == 0:
+        return index, vals, slice(0, 0)
+    lo, hi = index.min(), index.max() + 1
+    return index - lo, vals, slice(lo, hi)
+
+
+def _apply(a, index, vals, axis):
+    """Apply the weights of one axis to an array"""
+    if axis == 0:
+        out = a[index[:, 0]] * vals[:, 0, None]
+        for k in range(1, index.shape[1]):
+            out += a[index[:, k]] * vals[:, k, None]
+    else:
+        out = a[:, index[:, 0]] * vals[None, :, 0]
+        for k in range(1, index.shape[1]):
+            out += a[:, index[:, k]] * vals[None, :, k]
+    return out
+
+
+def _resample(source, shape, scale, method, rows, cols, source_shape):
+    """Resample one window"""
+    ri, rv, src_rows = _window(_weights(shape[0], source_shape[0], float(scale[0]), method), rows)
+    ci, cv, src_cols = _window(_weights(shape[1], source_shape[1], float(scale[1]), method), cols)
+    block = source(src_rows, src_cols)
+
+    if method == 'nearest':
+        return block[np.ix_(ri[:, 0], ci[:, 0])]
+
+    masked = isinstance(block, np.ma.MaskedArray)
+    if masked:
+        valid = ~np.ma.getmaskarray(block)
+        values = block.filled(0).astype(np.float32, copy=False)
+    elif block.dtype.kind == 'f':
+        valid = ~np.isnan(block)
+        values = np.where(valid, block, 0).astype(np.float32, copy=False)
+    else:
+        valid = None
+        values = block.astype(np.float32)
+
+    apply = lambda a: _apply(_apply(a, ri, rv, 0), ci, cv, 1)
+    out = apply(values)
+    if valid is None or valid.all():
+        return np.ma.masked_array(out, mask=False) if masked else out
+    weight = apply(valid.astype(np.float32))
+    empty = weight <= 1e-6
+    out /= np.where(empty, 1.0, weight)
+    if masked:
+        return np.ma.masked_array(out, mask=empty)
+    out[empty] = np.nan
+    return out
+
+
+def resample(source, shape, scale, method='bilinear', rows=None, cols=None,
+             source_shape=None):
+    """Resample a 2D band to another grid covering the same extent.
+
+    The resampling is separable and vectorized over each axis. It runs over
+    blocks of rows so only the input pixels needed by each block are touched
+    and temporary arrays stay small.
+
+    Args:
+        source: the 2D input array or a callable ``source(rows, cols)``
+            returning a window of it (e.g. read from disk), in which case
+            ``source_shape`` must be given
+        shape (tuple): the ``(nlines, nsamps)`` of the target grid
+        scale (tuple): the ``(y, x)`` size of a target pixel in input pixels
+        method (str): ``'nearest'``, ``'bilinear'`` or ``'average'``
+        rows (slice): the target rows to compute (all by default)
+        cols (slice): the target columns to compute (all by default)
+        source_shape (tuple): the ``(nlines, nsamps)`` of the input
+
+    Return:
+        np.ndarray : the resampled window. Nearest keeps the input type,
+        otherwise the result is float32. Masked (or NaN) input pixels are
+        excluded from the weights and outputs without valid input are masked
+        (or NaN).
+    """
+    if isinstance(source, np.ndarray):
+        array = source
+        source = lambda r, c: array[r, c]
+        source_shape = array.shape
+    elif source_shape is None:
+        raise RuntimeError('`source_shape` must be set for callable sources.')
+    rows = slice(0, shape[0]) if rows is None else rows
+    cols = slice(0, shape[1]) if cols is None else cols
+    step = _BLOCK_ROWS
+    if rows.stop - rows.start <= step:
+        return _resample(source, shape, scale, method, rows, cols, source_shape)
+    parts = [_resample(source, shape, scale, method, slice(r, min(r + step, rows.stop)),
+                       cols, source_shape)
+             for r in range(rows.start, rows.stop, step)]
+    if any(isinstance(p, np.ma.MaskedArray) for p in parts):
+        return np.ma.concatenate(parts, axis=0)
+    return np.concatenate(parts, axis=0)
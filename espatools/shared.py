@@ -0,0 +1,207 @@
+"""This module holds methods to share the bands of a ``RasterSet`` with worker
+processes through shared memory rather than pickling them."""
+
+__all__ = [
+    'SharedRasterSet',
+    'SharedRasterHandle',
+]
+
+import uuid
+import weakref
+
+import numpy as np
+
+from .raster import RasterSet
+
+
+# Byte alignment of each array in the shared segment
+_ALIGN = 64
+
+# Rasters attached in this process:
+#   token -> (SharedMemory, RasterSet, weak refs of views, attached, writeable)
+_ATTACHED = dict()
+
+
+def _shared_memory():
+    """Import ``multiprocessing.shared_memory`` (new in Python 3.8) only when
+    it is used so the rest of the package works on older versions."""
+    try:
+        from multiprocessing import shared_memory
+    except ImportError:
+        raise ImportError('Sharing rasters requires Python 3.8 or newer.')
+    return shared_memory
+
+
+def _open_segment(name):
+    """Attach to an existing shared memory segment without registering it
+    with the resource tracker where possible (the publisher owns it)."""
+    shared_memory = _shared_memory()
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # ``track`` is new in Python 3.13
+        return shared_memory.SharedMemory(name=name)
+
+
+def _views(buf, layout, writeable=False):
+    """Build the arrays described by a layout over a buffer. Also returns weak
+    references to the base arrays: NumPy does not hold a buffer export, so
+    these are the only way to know if any view (or view of a view) is alive.
+    """
+    views = dict()
+    refs = []
+    for name, (offset, shape, dtype, mask_offset) in layout.items():
+        data = np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset)
+        data.flags.writeable = writeable
+        refs.append(weakref.ref(data))
+        if mask_offset is not None:
+            mask = np.ndarray(shape, dtype=bool, buffer=buf, offset=mask_offset)
+            mask.flags.writeable = writeable
+            refs.append(weakref.ref(mask))
+            data = np.ma.MaskedArray(data, mask=mask, copy=False)
+        views[name] = data
+    return views, refs
+
+
+class SharedRasterHandle(object):
+    """A small, picklable reference to a ``RasterSet`` published with
+    ``SharedRasterSet``. Pass it to worker processes and call ``attach`` there
+    to get a ``RasterSet`` whose band data are zero-copy views of the shared
+    memory.
+    """
+
+    def __init__(self, token, segment, layout, meta):
+        self.token = token
+        self.segment = segment
+        self.layout = layout
+        self.meta = meta
+
+    def attach(self, writeable=False):
+        """Get the shared ``RasterSet`` in this process. The result is cached
+        so attaching repeatedly (e.g. once per task) is cheap. Attaching with
+        another ``writeable`` option replaces the band data of that raster
+        with new views; views taken earlier keep their access.
+
+        Args:
+            writeable (bool): allow writing to the shared band data. Writes
+                are visible to every process.
+
+        Return:
+            RasterSet : the raster with its band data in shared memory
+        """
+        cached = _ATTACHED.get(self.token)
+        if cached is not None and cached[3] and cached[4] == writeable:
+            return cached[1]
+        if cached is not None:
+            # Detaching failed earlier or the access changed: reuse the
+            # mapping and keep tracking the views still in use
+            shm, ras, refs = cached[:3]
+        else:
+            shm = _open_segment(self.segment)
+            ras = RasterSet.deserialize(self.meta)
+            refs = []
+        views, new_refs = _views(shm.buf, self.layout, writeable=writeable)
+        for name, data in views.items():
+            ras.bands[name].data = data
+        _ATTACHED[self.token] = (shm, ras, refs + new_refs, True, writeable)
+        return ras
+
+    def detach(self):
+        """Release the shared memory in this process. All references to the
+        attached band data must be dropped first."""
+        cached = _ATTACHED.get(self.token)
+        if cached is None:
+            return
+        shm, ras, refs = cached[:3]
+        for band in ras.bands.values():
+            band.data = None
+        refs = [r for r in refs if r() is not None]
+        if refs:
+            _ATTACHED[self.token] = (shm, ras, refs, False, cached[4])
+            raise RuntimeError('Views of the shared bands are still in use.')
+        del _ATTACHED[self.token]
+        shm.close()
+
+
+class SharedRasterSet(object):
+    """Publish the bands of a loaded ``RasterSet`` (and their masks) into one
+    shared memory segment.
+
+    The publisher owns the segment: call ``close`` (or use it as a context
+    manager) when the workers are done to free it. Workers use the picklable
+    ``handle`` to attach.
+
+    Args:
+        raster (RasterSet): the loaded raster to share
+        names (list(str)): the bands to share (all loaded bands by default)
+    """
+
+    def __init__(self, raster, names=None):
+        if names is None:
+            names = [k for k, b in raster.bands.items() if b.data is not None]
+        arrays = dict()
+        for nm in names:
+            if nm not in raster.bands.keys() or raster.bands[nm].data is None:
+                raise RuntimeError('Band (%s) unavailable.' % nm)
+            arrays[nm] = raster.bands[nm].data
+
+        # Lay out every array (and mask) in a single segment
+        layout = dict()
+        size = 0
+        align = lambda n: -(-n // _ALIGN) * _ALIGN
+        for nm, data in arrays.items():
+            offset = size
+            size = align(size + data.nbytes)
+            mask_offset = None
+            if isinstance(data, np.ma.MaskedArray):
+                mask_offset = size
+                size = align(size + data.size)
+            layout[nm] = (offset, data.shape, data.dtype.str, mask_offset)
+
+        self._shm = _shared_memory().SharedMemory(create=True, size=max(size, 1))
+        try:
+            views = _views(self._shm.buf, layout, writeable=True)[0]
+            for nm, data in arrays.items():
+                if isinstance(data, np.ma.MaskedArray):
+                    views[nm].data[...] = data.data
+                    views[nm].mask[...] = np.ma.getmaskarray(data)
+                else:
+                    views[nm][...] = data
+            del views
+        except Exception:
+            self._shm.close()
+            self._shm.unlink()
+            raise
+
+        # Band data is not a property so it is not serialized
+        meta = raster.serialize(include_class=False)
+        meta['bands'] = {k: v for k, v in meta['bands'].items() if k in layout}
+        self.handle = SharedRasterHandle(uuid.uuid4().hex, self._shm.name, layout, meta)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def nbytes(self):
+        """The size of the shared segment in bytes"""
+        return self._shm.size
+
+    def close(self):
+        """Detach in this process and free the shared segment. Workers that
+        are still attached keep their mapping until they detach or exit.
+
+        The segment is always freed. If views of the bands attached in this
+        process are still in use, the ``RuntimeError`` of ``detach`` is raised
+        and this process keeps its mapping until ``handle.detach`` succeeds.
+        """
+        if self._shm is None:
+            return
+        try:
+            self.handle.detach()
+        finally:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
@@ -0,0 +1,194 @@
+"""This module holds methods to save and load a ``RasterSet`` in a compact
+binary container: a metadata header followed by the raw band buffers and
+bit-packed masks. Uncompressed bands are memory mapped when loaded."""
+
+__all__ = [
+    'save_raster',
+    'load_raster',
+    'read_raster_header',
+]
+
+import json
+import os
+import stat
+import struct
+import tempfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .raster import RasterSet
+
+
+MAGIC = b'ESPARSET'
+VERSION = 1
+
+# magic, version, reserved, header length
+_PREFIX = struct.Struct('<8sIIQ')
+
+# Byte alignment of each buffer in the file
+_ALIGN = 64
+
+_CODECS = dict(
+    deflate=(lambda b, level: zlib.compress(b, level), zlib.decompress),
+)
+
+
+def _encode(buf, compress, level):
+    """Compress a buffer (or pass it through)"""
+    if compress is None:
+        return buf
+    return _CODECS[compress][0](buf, level)
+
+
+def save_raster(raster, filename, names=None, compress=None, level=6, threads=None):
+    """Save a ``RasterSet`` and its band data to a compact binary file.
+
+    Args:
+        raster (RasterSet): the raster to save
+        filename (str): the output file name
+        names (list(str)): the bands to save (all loaded bands by default)
+        compress: ``None``, ``'deflate'`` or a dictionary of band names to
+            either. Compressed bands cannot be memory mapped when loaded.
+        level (int): the compression level
+        threads (int): the number of threads compressing bands
+    """
+    if names is None:
+        names = [k for k, b in raster.bands.items() if b.data is not None]
+    if not isinstance(compress, dict):
+        compress = {nm: compress for nm in names}
+    for nm in names:
+        if nm not in raster.bands.keys() or raster.bands[nm].data is None:
+            raise RuntimeError('Band (%s) unavailable.' % nm)
+        if compress.get(nm) is not None and compress[nm] not in _CODECS:
+            raise RuntimeError('Compression (%s) unavailable.' % compress[nm])
+
+    # Gather the buffers: the data and the bit-packed mask of each band
+    jobs = []
+    for nm in names:
+        data = raster.bands[nm].data
+        mask = np.ma.getmask(data)
+        jobs.append((nm, 'data', np.ascontiguousarray(np.ma.getdata(data))))
+        if mask is not np.ma.nomask:
+            jobs.append((nm, 'mask', np.packbits(mask, axis=None)))
+    with ThreadPoolExecutor(max_workers=threads or os.cpu_count()) as pool:
+        encoded = list(pool.map(
+            lambda job: _encode(memoryview(job[2]).cast('B'), compress.get(job[0]), level), jobs))
+
+    # Build the band table
+    table = dict()
+    for nm in names:
+        data = raster.bands[nm].data
+        table[nm] = dict(
+            dtype=data.dtype.str,
+            shape=list(data.shape),
+            masked=isinstance(data, np.ma.MaskedArray),
+            compress=compress.get(nm),
+        )
+    meta = raster.serialize(include_class=False)
+    meta['bands'] = {k: v for k, v in meta['bands'].items() if k in table}
+
+    # Lay out the buffers after the header
+    align = lambda n: -(-n // _ALIGN) * _ALIGN
+    header = dict(meta=meta, bands=table)
+    size = 0
+    while True:
+        # Offsets depend on the header length which depends on the offsets
+        text = json.dumps(header).encode('utf-8')
+        position = align(_PREFIX.size + len(text))
+        if position == size:
+            break
+        size = position
+        for (nm, part, _), buf in zip(jobs, encoded):
+            table[nm][part] = [position, len(buf)]
+            position = align(position + len(buf))
+
+    # The buffers may be views of a memory mapped copy of ``filename``: write
+    # a new file next to it and only then replace it
+    folder, base = os.path.split(os.path.abspath(filename))
+    fd, temp = tempfile.mkstemp(prefix='.%s.' % base, suffix='.tmp', dir=folder)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_PREFIX.pack(MAGIC, VERSION, 0, len(text)))
+            f.write(text)
+            for (nm, part, _), buf in zip(jobs, encoded):
+                f.seek(table[nm][part][0])
+                f.write(buf)
+        if os.path.exists(filename):
+            os.chmod(temp, stat.S_IMODE(os.stat(filename).st_mode))
+        else:
+            os.chmod(temp, 0o644)
+        os.replace(temp, filename)
+    except BaseException:
+        os.remove(temp)
+        raise
+    return filename
+
+
+def read_raster_header(filename):
+    """Read the header of a file saved with ``save_raster``.
+
+    Return:
+        dict : the serialized raster metadata (``meta``) and the band table
+        (``bands``)
+    """
+    with open(filename, 'rb') as f:
+        magic, version, _, length = _PREFIX.unpack(f.read(_PREFIX.size))
+        if magic != MAGIC:
+            raise RuntimeError('%s is not a saved RasterSet.' % filename)
+        if version > VERSION:
+            raise RuntimeError('Unsupported RasterSet file version (%d).' % version)
+        return json.loads(f.read(length).decode('utf-8'))
+
+
+def load_raster(filename, names=None, mmap=True):
+    """Load a ``RasterSet`` saved with ``save_raster``.
+
+    Args:
+        filename (str): the file name
+        names (list(str)): the bands to load (all saved bands by default).
+            Other bands are not read.
+        mmap (bool): memory map uncompressed bands (read-only, zero-copy)
+            rather than reading them into memory
+
+    Return:
+        RasterSet : the raster with the loaded band data
+    """
+    header = read_raster_header(filename)
+    table = header['bands']
+    if names is None:
+        names = list(table.keys())
+    for nm in names:
+        if nm not in table:
+            raise RuntimeError('Band (%s) unavailable.' % nm)
+
+    meta = header['meta']
+    meta['bands'] = {k: v for k, v in meta['bands'].items() if k in names}
+    ras = RasterSet.deserialize(meta)
+
+    base = np.memmap(filename, dtype=np.uint8, mode='r') if mmap else None
+    with open(filename, 'rb') as f:
+
+        def read(entry, codec):
+            offset, length = entry
+            if codec is None and base is not None:
+                return base[offset:offset + length]
+            f.seek(offset)
+            buf = f.read(length)
+            if codec is not None:
+                buf = _CODECS[codec][1](buf)
+            return np.frombuffer(bytearray(buf), dtype=np.uint8)
+
+        for nm in names:
+            info = table[nm]
+            shape = tuple(info['shape'])
+            data = read(info['data'], info['compress']).view(info['dtype']).reshape(shape)
+            if info['masked']:
+                mask = np.ma.nomask
+                if 'mask' in info:
+                    bits = read(info['mask'], info['compress'])
+                    mask = np.unpackbits(bits, count=data.size).view(bool).reshape(shape)
+                data = np.ma.MaskedArray(data, mask=mask, copy=False)
+            ras.bands[nm].data = data
+    return ras
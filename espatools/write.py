@@ -0,0 +1,466 @@
+"""This module holds the file I/O methods for writing rasters to tiled,
+compressed GeoTIFF files."""
+
+__all__ = [
+    'GeoTiffWriter',
+    'write_geotiff',
+]
+
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+# TIFF field types
+_SHORT = 3
+_LONG = 4
+_ASCII = 2
+_DOUBLE = 12
+_TYPE_FORMATS = {_SHORT: 'H', _LONG: 'I', _ASCII: 's', _DOUBLE: 'd'}
+
+_COMPRESSION = dict(none=1, deflate=8)
+
+# Sample formats for each supported NumPy kind
+_SAMPLE_FORMATS = dict(u=1, i=2, f=3)
+
+# Geographic datums to the base EPSG code of their UTM zones (north)
+_UTM_EPSG = dict(WGS84=32600, NAD83=26900, NAD27=26700)
+
+# Geographic datums to their EPSG codes
+_GEOGRAPHIC_EPSG = dict(WGS84=4326, NAD83=4269, NAD27=4267)
+
+# ESPA projections written as user-defined projections: the GeoTIFF
+# coordinate transformation, the parameters property and the GeoTIFF keys of
+# each parameter (a missing parameter is the scale factor of 1)
+_USER_PROJECTIONS = dict(
+    ALBERS=(11, 'albers_proj_params', [
+        (3078, 'standard_parallel1'),
+        (3079, 'standard_parallel2'),
+        (3080, 'central_meridian'),
+        (3081, 'origin_latitude'),
+        (3082, 'false_easting'),
+        (3083, 'false_northing'),
+    ]),
+    PS=(15, 'ps_proj_params', [
+        (3081, 'latitude_true_scale'),
+        (3082, 'false_easting'),
+        (3083, 'false_northing'),
+        (3092, 'scale_factor'),
+        (3095, 'longitude_pole'),
+    ]),
+    SIN=(24, 'sin_proj_params', [
+        (3082, 'false_easting'),
+        (3083, 'false_northing'),
+        (3088, 'central_meridian'),
+    ]),
+)
+
+
+def _pack_ifd(entries, offset, next_offset):
+    """Pack a list of ``(tag, type, values)`` entries into a little endian
+    image file directory located at ``offset`` in the file."""
+    entries = sorted(entries, key=lambda e: e[0])
+    head = struct.pack('<H', len(entries))
+    data_offset = offset + 2 + 12 * len(entries) + 4
+    body = b''
+    extra = b''
+    for tag, typ, values in entries:
+        if typ == _ASCII:
+            raw = values.encode('ascii') + b'\x00'
+            count = len(raw)
+        else:
+            count = len(values)
+            raw = struct.pack('<%d%s' % (count, _TYPE_FORMATS[typ]), *values)
+        if len(raw) <= 4:
+            body += struct.pack('<HHI', tag, typ, count) + raw.ljust(4, b'\x00')
+        else:
+            body += struct.pack('<HHII', tag, typ, count, data_offset + len(extra))
+            extra += raw
+            if len(extra) % 2:
+                extra += b'\x00'
+    return head + body + struct.pack('<I', next_offset) + extra
+
+
+class _Level(object):
+    """Book keeping for one resolution level (the full image or an overview)
+    of a ``GeoTiffWriter``."""
+
+    def __init__(self, index, nlines, nsamps, tile_size):
+        self.index = index
+        self.nlines = nlines
+        self.nsamps = nsamps
+        self.ntx = -(-nsamps // tile_size)
+        self.nty = -(-nlines // tile_size)
+        self.rows = []
+        self.nrows = 0
+        self.pending = None
+        self.offsets = []
+        self.counts = []
+        self.coarser = None
+
+
+class GeoTiffWriter(object):
+    """Write a raster to a tiled, compressed GeoTIFF file.
+
+    Data is written incrementally with ``write``: pass horizontal strips of
+    the raster from top to bottom. Only one row of tiles is held in memory per
+    resolution level and the tiles of each row are encoded in parallel. The
+    image file directories are reserved at the start of the file so readers
+    can access the tile index (and any overviews) without scanning the data.
+
+    Args:
+        filename (str): the output file name
+        nlines (int): the number of lines (rows) of the raster
+        nsamps (int): the number of samples (columns) of the raster
+        nbands (int): the number of bands stored per pixel
+        dtype: the NumPy data type of the output
+        raster (RasterSet): if given, used to georeference the output with
+            its projection, corner points and pixel size
+        tile_size (int): the width and height of the tiles (multiple of 16)
+        compress (str): ``'deflate'`` or ``'none'``
+        level (int): the deflate compression level
+        predictor (bool): use horizontal differencing for integer data
+        overviews (int or bool): the number of overview levels (each half the
+            size of the previous). ``True`` adds levels until the image fits
+            in one tile.
+        resampling (str): ``'average'`` or ``'nearest'`` for overviews
+        nodata (float): the no data value. Masked values are filled with it.
+        epsg (int): the EPSG code of the output, overriding the one derived
+            from ``raster`` (required for projections that cannot be derived)
+        threads (int): the number of threads used to encode tiles
+    """
+
+    def __init__(self, filename, nlines, nsamps, nbands=1, dtype=np.float32,
+                 raster=None, tile_size=256, compress='deflate', level=6,
+                 predictor=True, overviews=0, resampling='average',
+                 nodata=None, epsg=None, threads=None):
+        if tile_size % 16 != 0:
+            raise RuntimeError('`tile_size` must be a multiple of 16.')
+        if compress not in _COMPRESSION:
+            raise RuntimeError('Compression (%s) unavailable.' % compress)
+        if resampling not in ('average', 'nearest'):
+            raise RuntimeError('Resampling (%s) unavailable.' % resampling)
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        if self.dtype.kind not in _SAMPLE_FORMATS:
+            raise RuntimeError('Data type (%s) unsupported.' % self.dtype)
+        self.filename = filename
+        self.nlines = int(nlines)
+        self.nsamps = int(nsamps)
+        self.nbands = int(nbands)
+        self.tile_size = tile_size
+        self.compress = compress
+        self.compress_level = level
+        self.predictor = predictor and self.dtype.kind in 'ui'
+        self.resampling = resampling
+        self.nodata = nodata
+        self.threads = threads or os.cpu_count()
+        self._geo = self._georeference(raster, epsg) if raster is not None else None
+
+        # Build the resolution levels
+        if overviews is True:
+            overviews = 0
+            ny, nx = self.nlines, self.nsamps
+            while ny > tile_size or nx > tile_size:
+                ny, nx = -(-ny // 2), -(-nx // 2)
+                overviews += 1
+        self.levels = [_Level(0, self.nlines, self.nsamps, tile_size)]
+        for i in range(int(overviews)):
+            prev = self.levels[-1]
+            lev = _Level(i + 1, -(-prev.nlines // 2), -(-prev.nsamps // 2), tile_size)
+            prev.coarser = lev
+            self.levels.append(lev)
+
+        # Reserve room for the directories at the start of the file
+        self._ifd_offsets = []
+        position = 8
+        for lev in self.levels:
+            self._ifd_offsets.append(position)
+            ntiles = lev.ntx * lev.nty
+            size = len(_pack_ifd(self._entries(lev, [0] * ntiles, [0] * ntiles), position, 0))
+            position += size + size % 2
+        self._rows_written = 0
+        self._pool = ThreadPoolExecutor(max_workers=self.threads)
+        self._fh = open(filename, 'wb')
+        self._fh.write(b'II' + struct.pack('<HI', 42, 8))
+        self._fh.write(b'\x00' * (position - 8))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._fh.close()
+            self._pool.shutdown()
+
+    @staticmethod
+    def _georeference(raster, epsg=None):
+        """Get the model transform and geo keys from a ``RasterSet``. UTM
+        projections are written as EPSG codes, Albers, polar stereographic and
+        sinusoidal projections as user-defined projections from their
+        parameters and GEO as a geographic system.
+        """
+        proj = raster.global_metadata.projection_information
+        ul = [c for c in proj.corner_point if c.location == 'UL']
+        ul = ul[0] if ul else proj.corner_point[0]
+        dx, dy = raster.pixel_size.x, raster.pixel_size.y
+        x0, y0 = ul.x, ul.y
+        if proj.grid_origin == 'CENTER':
+            # Corner points refer to pixel centers: shift to the pixel edge
+            x0, y0 = x0 - 0.5 * dx, y0 + 0.5 * dy
+
+        geographic = proj.projection == 'GEO'
+        # GTModelType and GTRasterType: pixel is area
+        keys = [(1024, 2 if geographic else 1), (1025, 1)]
+        doubles = []
+        if epsg is None and proj.projection == 'UTM' and proj.utm_proj_params:
+            zone = int(proj.utm_proj_params.get('zone_code'))
+            base = _UTM_EPSG.get(proj.datum)
+            if base is None:
+                raise RuntimeError('Datum (%s) unsupported: pass `epsg`.' % proj.datum)
+            epsg = base + abs(zone) + (100 if zone < 0 else 0)
+        if epsg is not None:
+            keys.append((2048 if geographic else 3072, int(epsg)))
+        elif geographic:
+            if proj.datum not in _GEOGRAPHIC_EPSG:
+                raise RuntimeError('Datum (%s) unsupported: pass `epsg`.' % proj.datum)
+            keys.append((2048, _GEOGRAPHIC_EPSG[proj.datum]))
+        elif proj.projection in _USER_PROJECTIONS:
+            transform, params, names = _USER_PROJECTIONS[proj.projection]
+            params = getattr(proj, params) or dict()
+            if proj.projection == 'SIN':
+                # A user-defined sphere
+                radius = float(params['sphere_radius'])
+                keys += [(2048, 32767), (2050, 32767), (2056, 32767)]
+                doubles += [(2057, radius), (2058, radius)]
+            elif proj.datum in _GEOGRAPHIC_EPSG:
+                keys.append((2048, _GEOGRAPHIC_EPSG[proj.datum]))
+            else:
+                raise RuntimeError('Datum (%s) unsupported: pass `epsg`.' % proj.datum)
+            # User-defined projected system and projection
+            keys += [(3072, 32767), (3074, 32767), (3075, transform)]
+            for key, name in names:
+                doubles.append((key, float(params[name]) if name in params else 1.0))
+        else:
+            raise RuntimeError('Projection (%s) unsupported: pass `epsg`.' % proj.projection)
+        if geographic:
+            keys.append((2054, 9102))
+        elif proj.units == 'meters':
+            keys.append((3076, 9001))
+
+        # Build the key directory: doubles are stored in GeoDoubleParams
+        entries = [(key, 0, 1, value) for key, value in keys]
+        entries += [(key, 34736, 1, i) for i, (key, _) in enumerate(doubles)]
+        entries.sort()
+        directory = [1, 1, 0, len(entries)]
+        for entry in entries:
+            directory += list(entry)
+        return dict(
+            scale=[dx, dy, 0.0],
+            tiepoint=[0.0, 0.0, 0.0, x0, y0, 0.0],
+            keys=directory,
+            doubles=[value for _, value in doubles],
+        )
+
+    def _entries(self, lev, offsets, counts):
+        """Get the directory entries for a level"""
+        spp = self.nbands
+        bits = self.dtype.itemsize * 8
+        rgb = spp == 3 and self.dtype == np.uint8
+        entries = [
+            (254, _LONG, [1 if lev.index else 0]),
+            (256, _LONG, [lev.nsamps]),
+            (257, _LONG, [lev.nlines]),
+            (258, _SHORT, [bits] * spp),
+            (259, _SHORT, [_COMPRESSION[self.compress]]),
+            (262, _SHORT, [2 if rgb else 1]),
+            (277, _SHORT, [spp]),
+            (284, _SHORT, [1]),
+            (322, _LONG, [self.tile_size]),
+            (323, _LONG, [self.tile_size]),
+            (324, _LONG, offsets),
+            (325, _LONG, counts),
+            (339, _SHORT, [_SAMPLE_FORMATS[self.dtype.kind]] * spp),
+        ]
+        if self.predictor:
+            entries.append((317, _SHORT, [2]))
+        if not rgb and spp > 1:
+            entries.append((338, _SHORT, [0] * (spp - 1)))
+        if self.nodata is not None:
+            if np.isnan(self.nodata):
+                entries.append((42113, _ASCII, 'nan'))
+            else:
+                entries.append((42113, _ASCII, repr(self.dtype.type(self.nodata).item())))
+        if self._geo is not None and lev.index == 0:
+            entries += [
+                (33550, _DOUBLE, self._geo['scale']),
+                (33922, _DOUBLE, self._geo['tiepoint']),
+                (34735, _SHORT, self._geo['keys']),
+            ]
+            if self._geo['doubles']:
+                entries.append((34736, _DOUBLE, self._geo['doubles']))
+        return entries
+
+    def _prepare(self, block):
+        """Make a strip a filled 3D array of the output type"""
+        if isinstance(block, np.ma.MaskedArray):
+            if self.nodata is None:
+                if self.dtype.kind != 'f':
+                    raise RuntimeError('`nodata` must be set to write masked integer data.')
+                block = block.filled(np.nan)
+            else:
+                block = block.filled(self.nodata)
+        block = np.asarray(block)
+        if block.ndim == 2:
+            block = block[:, :, None]
+        if block.ndim != 3 or block.shape[1:] != (self.nsamps, self.nbands):
+            raise RuntimeError('Block shape %s does not match the raster.' % (block.shape,))
+        if block.dtype.kind == 'f' and self.dtype.kind in 'ui':
+            block = np.rint(block)
+        return block.astype(self.dtype, copy=False)
+
+    def _encode(self, tile):
+        """Pad and encode a single tile"""
+        ts = self.tile_size
+        if tile.shape[0] != ts or tile.shape[1] != ts:
+            fill = 0 if self.nodata is None else self.nodata
+            padded = np.full((ts, ts, self.nbands), fill, dtype=self.dtype)
+            padded[:tile.shape[0], :tile.shape[1]] = tile
+            tile = padded
+        if self.predictor:
+            tile = tile.copy()
+            tile[:, 1:] = np.diff(tile, axis=1)
+        raw = np.ascontiguousarray(tile).tobytes()
+        if self.compress == 'deflate':
+            return zlib.compress(raw, self.compress_level)
+        return raw
+
+    def _write_tile_row(self, lev, rows):
+        """Encode a row of tiles in parallel and append them to the file"""
+        ts = self.tile_size
+        tiles = [rows[:, i * ts:(i + 1) * ts] for i in range(lev.ntx)]
+        for data in self._pool.map(self._encode, tiles):
+            lev.offsets.append(self._fh.tell())
+            lev.counts.append(len(data))
+            self._fh.write(data)
+
+    def _downsample(self, rows):
+        """Halve the resolution of an even number of rows"""
+        if rows.shape[1] % 2:
+            rows = np.concatenate([rows, rows[:, -1:]], axis=1)
+        if self.resampling == 'nearest':
+            return rows[::2, ::2]
+        ny, nx = rows.shape[0] // 2, rows.shape[1] // 2
+        values = rows.astype(np.float64)
+        valid = ~np.isnan(values)
+        if self.nodata is not None and not np.isnan(self.nodata):
+            valid &= values != self.nodata
+        values[~valid] = 0.0
+        total = values.reshape(ny, 2, nx, 2, -1).sum(axis=(1, 3))
+        count = valid.reshape(ny, 2, nx, 2, -1).sum(axis=(1, 3))
+        out = total / np.maximum(count, 1)
+        out[count == 0] = np.nan if self.nodata is None else self.nodata
+        if self.dtype.kind in 'ui':
+            out = np.rint(np.nan_to_num(out))
+        return out.astype(self.dtype)
+
+    def _push(self, lev, rows):
+        """Add rows to a level, writing any completed rows of tiles"""
+        ts = self.tile_size
+        lev.rows.append(rows)
+        lev.nrows += rows.shape[0]
+        if lev.nrows >= ts:
+            buf = np.concatenate(lev.rows, axis=0)
+            n = (buf.shape[0] // ts) * ts
+            for i in range(0, n, ts):
+                self._write_tile_row(lev, buf[i:i + ts])
+            lev.rows = [buf[n:].copy()]
+            lev.nrows = buf.shape[0] - n
+        if lev.coarser is not None:
+            if lev.pending is not None:
+                rows = np.concatenate([lev.pending, rows], axis=0)
+            n = rows.shape[0] - rows.shape[0] % 2
+            lev.pending = rows[n:] if n < rows.shape[0] else None
+            if n:
+                self._push(lev.coarser, self._downsample(rows[:n]))
+
+    def _flush(self, lev):
+        """Write the remaining partial row of tiles of a level"""
+        if lev.nrows:
+            self._write_tile_row(lev, np.concatenate(lev.rows, axis=0))
+            lev.rows = []
+            lev.nrows = 0
+        if lev.coarser is not None:
+            if lev.pending is not None:
+                self._push(lev.coarser, self._downsample(
+                    np.concatenate([lev.pending, lev.pending], axis=0)))
+                lev.pending = None
+            self._flush(lev.coarser)
+
+    def write(self, block):
+        """Write the next horizontal strip of the raster.
+
+        Args:
+            block (np.ndarray): an array of shape ``(rows, nsamps)`` or
+                ``(rows, nsamps, nbands)``. Masked arrays are filled with
+                ``nodata``.
+        """
+        block = self._prepare(block)
+        if self._rows_written + block.shape[0] > self.nlines:
+            raise RuntimeError('Too many rows written to %s.' % self.filename)
+        self._rows_written += block.shape[0]
+        self._push(self.levels[0], block)
+
+    def close(self):
+        """Finish writing: flush the partial tiles and write the directories"""
+        if self._fh.closed:
+            return
+        try:
+            if self._rows_written != self.nlines:
+                raise RuntimeError('Only %d of %d rows written to %s.' % (
+                    self._rows_written, self.nlines, self.filename))
+            self._flush(self.levels[0])
+            if self._fh.tell() >= 2**32:
+                raise RuntimeError('Output exceeds the 4 GB classic TIFF limit.')
+            for i, lev in enumerate(self.levels):
+                nxt = self._ifd_offsets[i + 1] if i + 1 < len(self.levels) else 0
+                ifd = _pack_ifd(self._entries(lev, lev.offsets, lev.counts),
+                                self._ifd_offsets[i], nxt)
+                self._fh.seek(self._ifd_offsets[i])
+                self._fh.write(ifd)
+        finally:
+            self._fh.close()
+            self._pool.shutdown()
+
+
+def write_geotiff(filename, data, raster=None, nlines=None, nsamps=None,
+                  nbands=None, dtype=None, **kwargs):
+    """Write a raster to a tiled, compressed GeoTIFF file.
+
+    Args:
+        filename (str): the output file name
+        data: a 2D or 3D array (``(nlines, nsamps[, nbands])``) or an
+            iterable of horizontal strips given from top to bottom. When an
+            iterable is given, ``nlines``, ``nsamps``, ``nbands`` and
+            ``dtype`` must be set.
+        raster (RasterSet): used to georeference the output
+        **kwargs: passed to :class:`GeoTiffWriter`
+    """
+    if isinstance(data, np.ndarray):
+        nlines, nsamps = data.shape[:2]
+        nbands = data.shape[2] if data.ndim == 3 else 1
+        dtype = data.dtype
+        step = kwargs.get('tile_size', 256)
+        array = data
+        data = (array[i:i + step] for i in range(0, nlines, step))
+    elif any(v is None for v in (nlines, nsamps, dtype)):
+        raise RuntimeError('`nlines`, `nsamps` and `dtype` must be set for block iterators.')
+    with GeoTiffWriter(filename, nlines, nsamps, nbands=nbands or 1,
+                       dtype=dtype, raster=raster, **kwargs) as writer:
+        for block in data:
+            writer.write(block)
+    return filename
@@ -18,8 +18,9 @@ setuptools.setup(
     long_description_content_type="text/x-rst",
     url="https://github.com/OpenGeoVis/espatools",
     packages=setuptools.find_packages(),
+    python_requires='>=3.6',
     install_requires=[
-        'numpy>=1.10',
+        'numpy>=1.17',
         'scipy>=1.1',
         'pillow>=5.2.0',
         'xmltodict>=0.11.0',
@@ -28,6 +29,7 @@ setuptools.setup(
     ],
     classifiers=(
         "Programming Language :: Python",
+        "Programming Language :: Python :: 3",
         "License :: OSI Approved :: BSD License",
         "Operating System :: OS Independent",
         'Topic :: Scientific/Engineering',
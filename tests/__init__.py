@@ -0,0 +1,63 @@
+"""Tests for espatools. Run with ``python -m unittest discover``."""
+
+import os
+
+import numpy as np
+from PIL import Image
+
+
+_BAND = """<band product="sr_refl" source="toa_refl" name="{name}" category="image" data_type="INT16" nlines="{nlines}" nsamps="{nsamps}" fill_value="-9999" scale_factor="0.000100">
+<short_name>LC08SR</short_name><long_name>band {name}</long_name><file_name>{name}.tif</file_name>
+<pixel_size x="{size}" y="{size}" units="meters"/><resample_method>none</resample_method><data_units>reflectance</data_units>
+<valid_range min="-2000.000000" max="16000.000000"/><app_version>LaSRC_1.3.0</app_version><production_date>2018-01-01T00:00:00Z</production_date>
+</band>"""
+
+_META = """<?xml version="1.0" encoding="UTF-8"?>
+<espa_metadata version="2.0">
+<global_metadata>
+<data_provider>USGS/EROS</data_provider><satellite>LANDSAT_8</satellite><instrument>OLI/TIRS_1T</instrument>
+<acquisition_date>2017-01-01</acquisition_date>
+<corner location="UL" latitude="40.0" longitude="-105.0"/><corner location="LR" latitude="39.0" longitude="-104.0"/>
+<bounding_coordinates><west>-105.0</west><east>-104.0</east><north>40.0</north><south>39.0</south></bounding_coordinates>
+<projection_information projection="UTM" datum="WGS84" units="meters">
+<corner_point location="UL" x="400000.0" y="4400000.0"/><corner_point location="LR" x="{lr_x}" y="{lr_y}"/>
+<grid_origin>CENTER</grid_origin><utm_proj_params><zone_code>13</zone_code></utm_proj_params>
+</projection_information>
+<orientation_angle>0.0</orientation_angle>
+</global_metadata>
+<bands>
+{bands}
+</bands>
+</espa_metadata>"""
+
+
+def make_scene(folder, nlines=70, nsamps=90, nbands=4, compression=None, pan=False):
+    """Write a small synthetic ESPA scene (UTM zone 13, 30 m pixels) whose
+    bands have a block of fill values in the upper left corner. The band
+    files are compressed with the given Pillow ``compression``. With ``pan``
+    a 15 m band (``sr_band8``) is added on a grid twice as fine.
+
+    Return:
+        str : the XML metadata file name
+    """
+    rng = np.random.RandomState(0)
+    grids = [('sr_band%d' % i, 1) for i in range(1, nbands + 1)]
+    if pan:
+        grids.append(('sr_band8', 2))
+    bands = []
+    for name, factor in grids:
+        shape = (nlines * factor, nsamps * factor)
+        data = rng.randint(-100, 12000, size=shape).astype(np.int16)
+        data[:5 * factor, :5 * factor] = -9999
+        kwargs = dict() if compression is None else dict(compression=compression)
+        Image.fromarray(data).save(os.path.join(folder, '%s.tif' % name), **kwargs)
+        bands.append(_BAND.format(name=name, nlines=shape[0], nsamps=shape[1],
+                                  size=30.0 / factor))
+    filename = os.path.join(folder, 'meta.xml')
+    with open(filename, 'w') as f:
+        f.write(_META.format(
+            lr_x=400000.0 + 30.0 * (nsamps - 1),
+            lr_y=4400000.0 - 30.0 * (nlines - 1),
+            bands='\n'.join(bands),
+        ))
+    return filename
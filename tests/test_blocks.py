@@ -0,0 +1,193 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import espatools
+
+from . import make_scene
+
+
+def box_sum(a):
+    """The 3x3 sum of each pixel, repeating the edges"""
+    a = np.pad(np.ma.filled(a, 0).astype(np.float64), 1, mode='edge')
+    ny, nx = a.shape[0] - 2, a.shape[1] - 2
+    return sum(a[i:i + ny, j:j + nx] for i in range(3) for j in range(3))
+
+
+class Strips(object):
+    """An output gathering the strips written to it"""
+
+    def __init__(self):
+        self.strips = []
+
+    def write(self, strip):
+        self.strips.append(strip)
+
+
+class TestWindows(unittest.TestCase):
+
+    def test_windows(self):
+        windows = list(espatools.iter_windows(10, 7, block_size=(4, 3), halo=1))
+        self.assertEqual(len(windows), 9)
+        covered = np.zeros((10, 7), dtype=int)
+        for w in windows:
+            covered[w.rows, w.cols] += 1
+            inner = np.arange(70).reshape(10, 7)[w.outer_rows, w.outer_cols][w.inner]
+            self.assertTrue(np.array_equal(inner, np.arange(70).reshape(10, 7)[w.rows, w.cols]))
+        self.assertTrue((covered == 1).all())
+        self.assertEqual(windows[0].outer_shape, (5, 4))
+        self.assertEqual(windows[-1].shape, (2, 1))
+        self.assertEqual(windows[-1].outer_rows, slice(7, 10))
+
+
+class TestMapBlocks(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def scene(self, **kwargs):
+        filename = make_scene(self.folder, **kwargs)
+        reader = espatools.RasterSetReader(filename=filename)
+        raster = espatools.RasterSetReader(filename=filename).read()
+        return reader, raster
+
+    def test_halo(self):
+        reader, raster = self.scene()
+        expected = box_sum(raster.bands['sr_band1'].data)
+        for source in (reader, raster):
+            result = source.map_blocks(box_sum, names=['sr_band1'], block_size=(16, 25),
+                                       halo=1, threads=3)
+            self.assertTrue(np.allclose(result, expected))
+        # Results the size of the block are kept as they are
+        result = raster.map_blocks(lambda a, window: np.full(window.shape, window.rows.start),
+                                   names=['sr_band1'], block_size=16, halo=2, pass_window=True)
+        self.assertTrue(np.array_equal(result[:, 0], np.arange(70) // 16 * 16))
+        with self.assertRaises(RuntimeError):
+            raster.map_blocks(lambda a: a[:-1], names=['sr_band1'], block_size=16, halo=2)
+
+    def test_write_out(self):
+        reader, raster = self.scene()
+        out = Strips()
+        func = lambda a, b: a - b
+        reader.map_blocks(func, names=['sr_band1', 'sr_band2'], out=out, block_size=(20, 40))
+        self.assertEqual([s.shape for s in out.strips], [(20, 90)] * 3 + [(10, 90)])
+        expected = raster.bands['sr_band1'].data - raster.bands['sr_band2'].data
+        result = np.ma.concatenate(out.strips, axis=0)
+        self.assertTrue(np.ma.allequal(result, expected))
+        self.assertTrue(np.array_equal(result.mask, expected.mask))
+
+    def test_array_out(self):
+        reader, raster = self.scene()
+        out = np.lib.format.open_memmap('%s/out.npy' % self.folder, mode='w+',
+                                        dtype=np.float32, shape=(70, 90))
+        result = reader.map_blocks(lambda a: a, names=['sr_band3'], out=out, cast=True,
+                                   block_size=32)
+        self.assertIs(result, out)
+        expected = raster.bands['sr_band3'].data.astype(np.float32).filled(np.nan)
+        self.assertTrue(np.array_equal(out, expected, equal_nan=True))
+
+    def test_memmap(self):
+        reader, raster = self.scene()
+        reader.read_meta()
+        self.assertIsInstance(reader.open_band(reader._bands['sr_band1']), np.memmap)
+        for window, (a, b) in reader.iter_blocks(names=['sr_band1', 'sr_band4'], block_size=24):
+            for block, nm in ((a, 'sr_band1'), (b, 'sr_band4')):
+                expected = raster.bands[nm].data[window.rows, window.cols]
+                self.assertTrue(np.ma.allequal(block, expected))
+                self.assertTrue(np.array_equal(np.ma.getmaskarray(block),
+                                               np.ma.getmaskarray(expected)))
+        self.assertEqual(reader._raw, dict())
+
+    def test_yflip_strips(self):
+        filename = make_scene(self.folder, compression='tiff_adobe_deflate')
+        reader = espatools.RasterSetReader(filename=filename, yflip=True)
+        reader.read_meta()
+        self.assertNotIsInstance(reader.open_band(reader._bands['sr_band2']), np.ndarray)
+        for cast in (False, True):
+            expected = espatools.RasterSetReader(filename=filename, yflip=True).read(
+                cast=cast).bands['sr_band2'].data
+            result = reader.map_blocks(lambda a: a, names=['sr_band2'], cast=cast,
+                                       block_size=(9, 50), threads=2)
+            self.assertTrue(np.array_equal(np.ma.filled(result, 0), np.ma.filled(expected, 0),
+                                           equal_nan=True))
+            self.assertTrue(np.array_equal(np.ma.getmaskarray(result), np.ma.getmaskarray(expected)))
+            # The fill values are at the bottom of flipped bands
+            self.assertTrue(np.ma.getmaskarray(result)[-1, 0] or np.isnan(result[-1, 0]))
+
+    def test_iter_raster(self):
+        reader, raster = self.scene()
+        n = 0
+        for window, (block,) in raster.iter_blocks(names=['sr_band1'], block_size=(30, None)):
+            self.assertIsInstance(block, np.ma.MaskedArray)
+            self.assertTrue(np.shares_memory(block, raster.bands['sr_band1'].data))
+            n += 1
+        self.assertEqual(n, 3)
+
+
+class TestDecodedBands(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.filename = make_scene(self.folder, nlines=600, compression='tiff_lzw')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def counted_reader(self):
+        reader = espatools.RasterSetReader(filename=self.filename)
+        reader.calls = []
+        read_tif = reader.read_tif
+        def counted(filename):
+            reader.calls.append(filename)
+            return read_tif(filename)
+        reader.read_tif = counted
+        return reader
+
+    def test_decoded_once(self):
+        # LZW files cannot be read strip by strip: each band is decoded once
+        # even though every block reads every band
+        reader = self.counted_reader()
+        blocks = list(reader.iter_blocks(block_size=(50, None)))
+        self.assertEqual(len(blocks), 12)
+        self.assertEqual(len(reader.calls), 4)
+
+        reader = self.counted_reader()
+        result = reader.map_blocks(lambda *b: sum(b), block_size=(50, None), threads=4)
+        self.assertEqual(len(reader.calls), 4)
+        bands = espatools.RasterSetReader(filename=self.filename).read().bands
+        self.assertTrue(np.ma.allequal(result, sum(b.data for b in bands.values())))
+
+
+class TestBlockTypes(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_read_dtype(self):
+        # Memory mapped, strip by strip and whole decoded bands all give the
+        # data type of ``read`` (Pillow decodes int16 to int32)
+        for compression in (None, 'tiff_adobe_deflate', 'tiff_lzw'):
+            filename = make_scene(self.folder, compression=compression)
+            reader = espatools.RasterSetReader(filename=filename)
+            raster = espatools.RasterSetReader(filename=filename).read()
+            names = ['sr_band1', 'sr_band2', 'sr_band3']
+            window, blocks = next(reader.iter_blocks(names=names, block_size=16))
+            for nm, block in zip(names, blocks):
+                self.assertEqual(block.dtype, raster.bands[nm].data.dtype)
+            func = lambda *b: sum(b)
+            result = reader.map_blocks(func, names=names, block_size=16)
+            expected = raster.map_blocks(func, names=names, block_size=16)
+            self.assertEqual(result.dtype, expected.dtype)
+            self.assertTrue(np.ma.allequal(result, expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
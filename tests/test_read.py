@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import espatools
+
+from . import make_scene
+
+
+class TestIncrementalRead(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.filename = make_scene(self.folder)
+        self.reader = espatools.RasterSetReader(filename=self.filename)
+        self.calls = []
+        read_tif = self.reader.read_tif
+        def counted(filename):
+            self.calls.append(os.path.basename(filename))
+            return read_tif(filename)
+        self.reader.read_tif = counted
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def fresh(self, **kwargs):
+        return espatools.RasterSetReader(filename=self.filename).read(**kwargs)
+
+    def test_missing_bands(self):
+        self.reader.read(allowed=['sr_band1'])
+        self.assertEqual(self.calls, ['sr_band1.tif'])
+        ras = self.reader.read(allowed=['sr_band1', 'sr_band2'])
+        self.assertEqual(self.calls, ['sr_band1.tif', 'sr_band2.tif'])
+        self.assertEqual(sorted(ras.bands.keys()), ['sr_band1', 'sr_band2'])
+        self.reader.read()
+        self.assertEqual(sorted(self.calls), ['sr_band%d.tif' % i for i in range(1, 5)])
+
+    def test_cast_toggle(self):
+        masked = self.reader.read()
+        casted = self.reader.read(cast=True)
+        again = self.reader.read()
+        self.assertEqual(len(self.calls), 4)
+        expected = self.fresh(cast=True)
+        for name, band in casted.bands.items():
+            self.assertTrue(np.array_equal(band.data, expected.bands[name].data, equal_nan=True))
+            self.assertTrue(np.ma.allequal(again.bands[name].data, masked.bands[name].data))
+
+    def test_earlier_rasters_unchanged(self):
+        masked = self.reader.read(allowed=['sr_band1', 'sr_band2'])
+        data = masked.bands['sr_band1'].data
+        self.reader.read(cast=True)
+        self.reader.read(allowed=['sr_band3'])
+        self.assertEqual(sorted(masked.bands.keys()), ['sr_band1', 'sr_band2'])
+        self.assertIs(masked.bands['sr_band1'].data, data)
+        self.assertIsInstance(data, np.ma.MaskedArray)
+        self.assertTrue(np.ma.allequal(data, self.fresh().bands['sr_band1'].data))
+
+    def test_edits_stay_local(self):
+        ras = self.reader.read(allowed=['sr_band2'])
+        ras.bands['sr_band2'].data += 1
+        for cast in (True, False):
+            data = self.reader.read(allowed=['sr_band2'], cast=cast).bands['sr_band2'].data
+            expected = self.fresh(allowed=['sr_band2'], cast=cast).bands['sr_band2'].data
+            self.assertTrue(np.array_equal(np.ma.getdata(data), np.ma.getdata(expected),
+                                           equal_nan=True))
+
+    def test_allowed_evicts(self):
+        self.reader.read(allowed=['sr_band1', 'sr_band2'])
+        self.reader.read(allowed=['sr_band2'])
+        self.assertEqual(sorted(self.reader._raw.keys()), ['sr_band2'])
+        self.reader.read(allowed=['sr_band1'])
+        self.assertEqual(self.calls.count('sr_band1.tif'), 2)
+
+    def test_file_changes(self):
+        self.reader.read()
+        stat = os.stat(self.filename)
+        os.utime(self.filename, (stat.st_atime, stat.st_mtime + 10))
+        self.reader.read()
+        self.assertEqual(len(self.calls), 8)
+
+    def test_clear_cache(self):
+        self.reader.read()
+        self.reader.clear_cache()
+        self.reader.read()
+        self.assertEqual(len(self.calls), 4)
+        self.reader.read(cast=True)
+        self.assertEqual(len(self.calls), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
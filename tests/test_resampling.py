@@ -0,0 +1,167 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import properties
+
+import espatools
+from espatools.resampling import grid_scale, reference_band, resample
+
+from . import make_scene
+
+try:
+    import pyvista
+except ImportError:
+    pyvista = None
+
+
+def ramp(ny, nx):
+    y, x = np.mgrid[:ny, :nx]
+    return (2.0 * y + 3.0 * x).astype(np.float32)
+
+
+class TestResample(unittest.TestCase):
+
+    def test_nearest(self):
+        a = np.arange(48, dtype=np.int16).reshape(6, 8)
+        down = resample(a, (3, 4), (2.0, 2.0), method='nearest')
+        self.assertEqual(down.dtype, a.dtype)
+        self.assertTrue(np.array_equal(down, a[1::2, 1::2]))
+        up = resample(a, (12, 16), (0.5, 0.5), method='nearest')
+        self.assertTrue(np.array_equal(up, a.repeat(2, axis=0).repeat(2, axis=1)))
+
+    def test_bilinear(self):
+        a = ramp(6, 8)
+        up = resample(a, (12, 16), (0.5, 0.5), method='bilinear')
+        self.assertEqual(up.dtype, np.float32)
+        # Pixel centers of the fine grid, clamped to the coarse grid edges
+        y = np.clip(np.arange(12) / 2.0 - 0.25, 0, 5)
+        x = np.clip(np.arange(16) / 2.0 - 0.25, 0, 7)
+        self.assertTrue(np.allclose(up, 2.0 * y[:, None] + 3.0 * x[None, :]))
+        # Downsampling by two interpolates between the four pixels
+        down = resample(a, (3, 4), (2.0, 2.0), method='bilinear')
+        self.assertTrue(np.allclose(down, (a[::2, ::2] + a[1::2, 1::2]) / 2.0))
+
+    def test_average(self):
+        a = np.arange(48, dtype=np.float32).reshape(6, 8)
+        down = resample(a, (3, 4), (2.0, 2.0), method='average')
+        self.assertTrue(np.allclose(down, a.reshape(3, 2, 4, 2).mean(axis=(1, 3))))
+        # Partial pixels are weighted by their overlap
+        row = resample(np.array([[0.0, 3.0, 6.0]]), (1, 2), (1.0, 1.5), method='average')
+        self.assertTrue(np.allclose(row, [[1.0, 5.0]]))
+        flat = resample(np.full((9, 9), 5.0), (6, 6), (1.5, 1.5), method='average')
+        self.assertTrue(np.allclose(flat, 5.0))
+
+    def test_masked(self):
+        a = np.ma.masked_array(np.arange(16, dtype=np.int32).reshape(4, 4), mask=False)
+        a[0, 0] = np.ma.masked
+        a[2:, 2:] = np.ma.masked
+        down = resample(a, (2, 2), (2.0, 2.0), method='average')
+        self.assertIsInstance(down, np.ma.MaskedArray)
+        # Masked pixels get no weight and blocks without valid pixels are masked
+        self.assertAlmostEqual(down[0, 0], (1 + 4 + 5) / 3.0, places=5)
+        self.assertAlmostEqual(down[0, 1], a[:2, 2:].mean(), places=5)
+        self.assertTrue(down.mask[1, 1])
+        self.assertFalse(down.mask[:, 0].any())
+        # NaNs behave the same for casted bands
+        f = a.astype(np.float32).filled(np.nan)
+        casted = resample(f, (2, 2), (2.0, 2.0), method='average')
+        self.assertTrue(np.isnan(casted[1, 1]))
+        self.assertTrue(np.allclose(casted[~down.mask], down.compressed()))
+        # Nearest only picks pixels and keeps their masks
+        nearest = resample(a, (8, 8), (0.5, 0.5), method='nearest')
+        self.assertTrue(nearest.mask[:2, :2].all())
+        self.assertEqual(nearest.mask.sum(), 4 * (1 + 4))
+
+    def test_windows(self):
+        a = ramp(150, 40)
+        full = resample(a, (300, 80), (0.5, 0.5), method='bilinear')
+        self.assertEqual(full.shape, (300, 80))
+        window = resample(a, (300, 80), (0.5, 0.5), rows=slice(120, 270), cols=slice(5, 31))
+        self.assertTrue(np.array_equal(window, full[120:270, 5:31]))
+        reads = []
+        def source(rows, cols):
+            reads.append((rows.start, rows.stop, cols.start, cols.stop))
+            return a[rows, cols]
+        window = resample(source, (300, 80), (0.5, 0.5), rows=slice(10, 20),
+                          cols=slice(40, 50), source_shape=a.shape)
+        self.assertTrue(np.array_equal(window, full[10:20, 40:50]))
+        # Only the input pixels needed are read
+        self.assertEqual(reads, [(4, 11, 19, 26)])
+        with self.assertRaises(RuntimeError):
+            resample(source, (300, 80), (0.5, 0.5))
+        with self.assertRaises(RuntimeError):
+            resample(a, (75, 20), (2.0, 2.0), method='cubic')
+
+
+class TestRasterResample(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        reader = espatools.RasterSetReader(filename=make_scene(self.folder, pan=True))
+        self.raster = reader.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_grid_scale(self):
+        bands = self.raster.bands
+        ref = reference_band(bands.values())
+        self.assertEqual(ref.name, 'sr_band1')
+        self.assertIsNone(grid_scale(bands['sr_band2'], ref))
+        self.assertEqual(grid_scale(bands['sr_band8'], ref), (2.0, 2.0))
+        self.assertEqual(grid_scale(ref, bands['sr_band8']), (0.5, 0.5))
+        band = properties.copy(bands['sr_band2'])
+        band.nsamps -= 1
+        with self.assertRaises(RuntimeError):
+            grid_scale(band, ref)
+        # A band on another grid must cover the same extent
+        band = properties.copy(bands['sr_band8'])
+        band.nlines += 4
+        with self.assertRaises(RuntimeError):
+            grid_scale(band, ref)
+        band.nlines -= 5
+        self.assertEqual(grid_scale(band, ref), (2.0, 2.0))
+
+    def test_validate(self):
+        self.assertTrue(self.raster.validate())
+        self.assertEqual((self.raster.nlines, self.raster.nsamps), (70, 90))
+        self.raster.bands['sr_band8'].nsamps = 200
+        with self.assertRaises(RuntimeError):
+            self.raster.validate()
+
+    def test_resample(self):
+        pan = self.raster.bands['sr_band8'].data
+        down = self.raster.resample('sr_band8', method='average')
+        self.assertEqual(down.shape, (70, 90))
+        self.assertTrue(np.ma.allclose(down, resample(pan, (70, 90), (2.0, 2.0), method='average')))
+        self.assertIs(self.raster.resample('sr_band1'), self.raster.bands['sr_band1'].data)
+        up = self.raster.resample('sr_band1', target='sr_band8', method='nearest')
+        self.assertTrue(np.ma.allequal(up, self.raster.bands['sr_band1'].data.repeat(2, 0).repeat(2, 1)))
+
+    def test_pan_sharpen(self):
+        names = ['sr_band4', 'sr_band3', 'sr_band2']
+        up = [self.raster.resample(nm, target='sr_band8') for nm in names]
+        # With a pan band equal to the mean intensity the Brovey transform
+        # leaves the upsampled bands unchanged
+        self.raster.bands['sr_band8'].data = (up[0] + up[1] + up[2]) / 3.0
+        rgb = self.raster.get_rgb(names=names, pan='sr_band8')
+        self.assertEqual(rgb.shape, (140, 180, 3))
+        self.assertEqual(rgb.dtype, np.uint8)
+        for i, band in enumerate(up):
+            expected = ((band - band.min()) * (255 / (band.max() - band.min()))).astype('uint8')
+            diff = np.abs(rgb[..., i].astype(int) - expected)
+            self.assertLessEqual(diff.max(), 1)
+        self.assertEqual(self.raster.get_rgb(names=names).shape, (70, 90, 3))
+
+    @unittest.skipIf(pyvista is None, 'pyvista is not installed')
+    def test_pyvista(self):
+        # The last band is the pan band: its mask is taken on the raster grid
+        grid = self.raster.to_pyvista()
+        self.assertEqual(grid['sr_band8'].size, 70 * 90)
+        self.assertEqual(grid['valid_mask'].size, 70 * 90)
+
+
+if __name__ == '__main__':
+    unittest.main()
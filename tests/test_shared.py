@@ -0,0 +1,99 @@
+import multiprocessing
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+import espatools
+
+from . import make_scene
+
+
+def _band_sum(args):
+    handle, name = args
+    raster = handle.attach()
+    data = raster.bands[name].data
+    total = int(data.sum()), int(np.ma.count_masked(data))
+    del data, raster
+    handle.detach()
+    return total
+
+
+def _band_write(args):
+    handle, name, value = args
+    raster = handle.attach(writeable=True)
+    raster.bands[name].data[0, -1] = value
+    del raster
+    handle.detach()
+
+
+@unittest.skipIf(sys.version_info < (3, 8), 'shared memory requires Python 3.8')
+class TestSharedRaster(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        reader = espatools.RasterSetReader(filename=make_scene(self.folder))
+        self.raster = reader.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def assertUnlinked(self, segment):
+        from multiprocessing import shared_memory
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name=segment)
+
+    def test_pool(self):
+        names = list(self.raster.bands.keys())
+        with espatools.SharedRasterSet(self.raster) as shared:
+            pool = multiprocessing.Pool(2)
+            try:
+                sums = pool.map(_band_sum, [(shared.handle, nm) for nm in names])
+                pool.map(_band_write, [(shared.handle, 'sr_band2', 42)])
+            finally:
+                pool.close()
+                pool.join()
+            attached = shared.handle.attach()
+            self.assertEqual(attached.bands['sr_band2'].data[0, -1], 42)
+            del attached
+        for nm, (total, masked) in zip(names, sums):
+            data = self.raster.bands[nm].data
+            self.assertEqual(total, int(data.sum()))
+            self.assertEqual(masked, int(np.ma.count_masked(data)))
+        self.assertUnlinked(shared.handle.segment)
+
+    def test_attach(self):
+        with espatools.SharedRasterSet(self.raster, names=['sr_band1']) as shared:
+            raster = shared.handle.attach()
+            self.assertEqual(list(raster.bands.keys()), ['sr_band1'])
+            self.assertIs(shared.handle.attach(), raster)
+            data = raster.bands['sr_band1'].data
+            self.assertFalse(data.flags.writeable)
+            self.assertTrue(np.ma.allequal(data, self.raster.bands['sr_band1'].data))
+            self.assertTrue(np.array_equal(data.mask, self.raster.bands['sr_band1'].data.mask))
+            writeable = shared.handle.attach(writeable=True).bands['sr_band1'].data
+            self.assertTrue(writeable.flags.writeable)
+            writeable[1, 1] = 7
+            self.assertEqual(data[1, 1], 7)
+            del raster, data, writeable
+
+    def test_close_in_use(self):
+        shared = espatools.SharedRasterSet(self.raster, names=['sr_band1'])
+        data = shared.handle.attach().bands['sr_band1'].data
+        with self.assertRaises(RuntimeError):
+            shared.close()
+        # The segment is freed while the views stay usable until detached
+        self.assertUnlinked(shared.handle.segment)
+        self.assertTrue(np.ma.allequal(data, self.raster.bands['sr_band1'].data))
+        del data
+        shared.handle.detach()
+
+    def test_unavailable(self):
+        with self.assertRaises(RuntimeError):
+            espatools.SharedRasterSet(self.raster, names=['sr_band9'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import espatools
+
+from . import make_scene
+
+
+class TestStore(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.reader = espatools.RasterSetReader(filename=make_scene(self.folder))
+        self.raster = self.reader.read()
+        self.filename = '%s/scene.rset' % self.folder
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def assertBandsEqual(self, a, b):
+        self.assertEqual(a.dtype, b.dtype)
+        self.assertTrue(np.array_equal(np.ma.getdata(a), np.ma.getdata(b), equal_nan=True))
+        self.assertTrue(np.array_equal(np.ma.getmaskarray(a), np.ma.getmaskarray(b)))
+
+    def test_round_trip(self):
+        for compress in (None, 'deflate'):
+            for mmap in (True, False):
+                self.raster.save(self.filename, compress=compress)
+                loaded = espatools.load_raster(self.filename, mmap=mmap)
+                self.assertEqual(loaded.serialize(), self.raster.serialize())
+                for name, band in self.raster.bands.items():
+                    data = loaded.bands[name].data
+                    self.assertIsInstance(data, np.ma.MaskedArray)
+                    self.assertBandsEqual(data, band.data)
+                del loaded, data
+
+    def test_casted(self):
+        raster = self.reader.read(cast=True)
+        raster.save(self.filename, compress={'sr_band1': 'deflate'})
+        loaded = espatools.load_raster(self.filename)
+        for name, band in raster.bands.items():
+            self.assertNotIsInstance(loaded.bands[name].data, np.ma.MaskedArray)
+            self.assertBandsEqual(loaded.bands[name].data, band.data)
+
+    def test_names(self):
+        self.raster.save(self.filename, names=['sr_band1', 'sr_band3'])
+        header = espatools.read_raster_header(self.filename)
+        self.assertEqual(sorted(header['bands'].keys()), ['sr_band1', 'sr_band3'])
+        loaded = espatools.load_raster(self.filename, names=['sr_band3'])
+        self.assertEqual(list(loaded.bands.keys()), ['sr_band3'])
+        self.assertBandsEqual(loaded.bands['sr_band3'].data,
+                              self.raster.bands['sr_band3'].data)
+
+    def test_overwrite_mapped(self):
+        self.raster.save(self.filename)
+        loaded = espatools.load_raster(self.filename)
+        loaded.save(self.filename, compress='deflate')
+        for name, band in self.raster.bands.items():
+            self.assertBandsEqual(loaded.bands[name].data, band.data)
+            self.assertBandsEqual(espatools.load_raster(self.filename).bands[name].data,
+                                  band.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image
+
+import espatools
+
+from . import make_scene
+
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+
+class TestGeoTiff(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        reader = espatools.RasterSetReader(filename=make_scene(self.folder))
+        self.raster = reader.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_band_round_trip(self):
+        filename = '%s/band.tif' % self.folder
+        self.raster.to_geotiff(filename, names=['sr_band1'], tile_size=32, overviews=1)
+        img = Image.open(filename)
+        data = self.raster.bands['sr_band1'].data
+        self.assertTrue(np.array_equal(np.array(img), data.data))
+        # The pixel is a point at the corner centers: the tiepoint is the
+        # outer corner of the upper left pixel
+        self.assertEqual(img.tag_v2[33922][3:5], (399985.0, 4400015.0))
+        self.assertEqual(img.tag_v2[33550][:2], (30.0, 30.0))
+        self.assertEqual(int(img.tag_v2[42113]), -9999)
+        self.assertEqual(img.n_frames, 2)
+
+    def test_rgb_round_trip(self):
+        filename = '%s/rgb.tif' % self.folder
+        self.raster.to_geotiff(filename, scheme='true')
+        img = Image.open(filename)
+        rgb = np.ma.filled(self.raster.get_rgb(scheme='true'), 0)
+        self.assertEqual(img.mode, 'RGB')
+        self.assertTrue(np.array_equal(np.array(img), rgb))
+
+    def test_yflip(self):
+        names = ['sr_band2']
+        self.raster.to_geotiff('%s/north.tif' % self.folder, names=names)
+        reader = espatools.RasterSetReader(filename='%s/meta.xml' % self.folder, yflip=True)
+        reader.read().to_geotiff('%s/south.tif' % self.folder, names=names)
+        north = np.array(Image.open('%s/north.tif' % self.folder))
+        south = np.array(Image.open('%s/south.tif' % self.folder))
+        self.assertTrue(np.array_equal(north, south))
+
+    @unittest.skipIf(tifffile is None, 'tifffile is not installed')
+    def test_multiband_round_trip(self):
+        filename = '%s/bands.tif' % self.folder
+        names = ['sr_band1', 'sr_band3']
+        self.raster.to_geotiff(filename, names=names, tile_size=48)
+        with tifffile.TiffFile(filename) as tif:
+            data = tif.asarray()
+            epsg = tif.geotiff_metadata['ProjectedCSTypeGeoKey']
+        expected = np.dstack([self.raster.bands[nm].data.data for nm in names])
+        self.assertTrue(np.array_equal(data, expected))
+        self.assertEqual(int(epsg), 32613)
+
+
+if __name__ == '__main__':
+    unittest.main()